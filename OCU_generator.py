@@ -0,0 +1,113 @@
+import argparse
+
+
+# Define the OCU (Output Control Unit) ROM Addressing scheme:
+#   m v v v v v v v v
+#   where:
+#       m -> display mode, set by the OCU_2s signal (0 = unsigned, 1 = two's complement)
+#       v -> the value on the output register
+ADDRESS_BITS = 9
+MODE_2S = 1 << 8
+
+# Define how each part of the display is encoded in a ROM word, most significant nibble first
+# The circuit's digit displays are fed one nibble each
+layout = ["sign", "hundreds", "tens", "ones"]
+
+# Define the nibble shown for each digit and for the sign
+digits = {
+    0: 0x0,
+    1: 0x1,
+    2: 0x2,
+    3: 0x3,
+    4: 0x4,
+    5: 0x5,
+    6: 0x6,
+    7: 0x7,
+    8: 0x8,
+    9: 0x9,
+}
+signs = {
+    "+": 0x0,
+    "-": 0x1,
+}
+
+# Output file
+ROM_TEXT = "./OCU-rom"
+
+
+# Generate the OCU ROM
+def main():
+    argParse()
+
+    Write_Text(rom, ROM_TEXT)
+    print("OCU ROM written")
+
+
+# Split an address into the sign and magnitude shown on the display
+def Decode_Address(address: int) -> tuple:
+    value = address & 0xff
+    if address & MODE_2S and value & 0x80:
+        return "-", 256 - value
+    return "+", value
+
+
+# Build the ROM word for an address from the layout and the digit encoding
+def Gen_Word(address: int) -> int:
+    sign, magnitude = Decode_Address(address)
+    parts = {
+        "sign": signs[sign],
+        "hundreds": digits[magnitude // 100],
+        "tens": digits[magnitude // 10 % 10],
+        "ones": digits[magnitude % 10],
+    }
+
+    word = 0
+    for part in layout:
+        word = (word << 4) | parts[part]
+    return word
+
+
+# Build the whole ROM, one word for every address
+def Gen_Rom() -> tuple:
+    return tuple(Gen_Word(address) for address in range(1 << ADDRESS_BITS))
+
+
+# Build the text shown on the display for every address
+def Gen_Display() -> tuple:
+    display = []
+    for address in range(1 << ADDRESS_BITS):
+        sign, magnitude = Decode_Address(address)
+        display.append(("-" if sign == "-" else "") + str(magnitude))
+    return tuple(display)
+
+
+# Precomputed ROM contents and display text, built once when this file is imported
+# Tools can look up what the display shows for an OUT value without doing any arithmetic
+rom = Gen_Rom()
+display = Gen_Display()
+
+
+# Look up what the display shows for an output value
+def Display_Value(value: int, twosComplement: bool = False) -> str:
+    return display[(MODE_2S if twosComplement else 0) | value]
+
+
+# Write the ROM as a Logisim 'v3.0 hex words addressed' file, 16 words per line
+def Write_Text(rom: tuple, filePath: str):
+    lines = ["v3.0 hex words addressed\n"]
+    for address in range(0, len(rom), 16):
+        lines.append(f'{address:03x}: ' + ' '.join(f'{word:04x}' for word in rom[address:address + 16]) + "\n")
+
+    file = open(filePath, 'w')
+    file.writelines(lines)
+    file.close()
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='The SAP-1 OCU (Output Control Unit) ROM generator!')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,30 @@
 import argparse
+import asyncio
+import concurrent.futures
+import dataclasses
 from dataclasses import dataclass
 from operator import contains
+import functools
+import glob
+import hashlib
+import importlib.util
+import json
+import mmap
 import os
 import pathlib
+import re
 import sys
+import time
 import typing
-import shutil
+
+
+# The microcode generator and ROM live in the root of the project
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROM = os.path.join(ROOT_DIR, "microcode-rom")
+
+# So is the machine description, which sets the size of RAM and how instructions are laid out in it
+sys.path.insert(0, ROOT_DIR)
+from machine_description import DEFAULT_MACHINE, Load_Machine, Machine
 
 
 @dataclass
@@ -16,428 +35,1607 @@ class FileProps:
     fullPath: os.path
 
 
+@dataclass
+class Token:
+    """Class for a single tokenized line of assembly"""
+    mnemonic: str
+    args: typing.List[str]
+    lineNumber: int
+
+    def __str__(self) -> str:
+        return ' '.join([self.mnemonic] + self.args)
+
+
+@dataclass
+class Optimization:
+    """Class for a single change made by the peephole optimizer"""
+    description: str
+    lineNumber: int
+    bytesSaved: int
+    cyclesSaved: int
+
+
+@dataclass
+class BasicBlock:
+    """Class for a straight run of instructions that is only ever entered at its first one and left at its last one"""
+    start: int
+    end: int
+    cycles: int
+    successors: typing.List[int]
+
+
+@dataclass
+class Loop:
+    """Class for a loop in the control flow graph and what one trip around it costs"""
+    header: int
+    blocks: typing.List[int]
+    minCycles: int
+    maxCycles: int
+
+
+@dataclass
+class AssemblyResult:
+    """Class for the outcome of assembling a single file"""
+    inputFile: str
+    outputFile: str
+    succeeded: bool
+    error: str = ''
+    image: bytes = b''
+
+
+@dataclass
+class Relocation:
+    """Class for an operand of an object module that is only known once the module is placed, the symbol's address plus the addend"""
+    offset: int
+    symbol: str
+    addend: int
+    limit: int
+    lineNumber: int
+
+
+@dataclass
+class DataDirective:
+    """Class for a 'set' directive of an object module, the address and value are each (symbol or None, addend)"""
+    address: typing.Tuple[str, int]
+    value: typing.Tuple[str, int]
+    lineNumber: int
+
+
+@dataclass
+class ObjectModule:
+    """Class for a relocatable object module, code assembled at address 0 along with what the linker needs to place it anywhere"""
+    name: str
+    machine: Machine
+    key: str
+    code: bytes
+    symbols: typing.Dict[str, int]
+    relocations: typing.List[Relocation]
+    directives: typing.List[DataDirective]
+
+
+# Image formats and the extension batch and watch mode give their output files
+IMAGE_EXTENSIONS = {
+    'logisim': '.bin',
+    'raw': '.bin',
+    'ihex': '.hex',
+}
+
+# Instructions that take a RAM address, and the ones that jump to one
+MEMORY_MNEMONICS = ('lda', 'add', 'sub', 'sta')
+JUMP_MNEMONICS = ('jmp', 'jc', 'jz')
+
+# Layout version of object files, bump it when the layout changes
+OBJECT_FORMAT = 1
+
+
+class AssemblyError(Exception):
+    """Raised when a program can not be assembled, the message is the full error report"""
+
+    def __init__(self, message: str, lineNumber: int = None):
+        super().__init__(message)
+        self.lineNumber = lineNumber
+
+
+class AssemblyCache:
+    """On-disk cache of assembled images keyed by a hash of the normalized source and the assembler version"""
+
+    def __init__(self, cacheDir: str):
+        self.cacheDir = cacheDir
+        os.makedirs(cacheDir, exist_ok=True)
+
+    # Get the cache key for normalized source, the same source assembles differently for another machine
+    def key(self, normalized: str, machine: Machine = DEFAULT_MACHINE) -> str:
+        return hashlib.sha256((assemblerVersion() + "\n" + repr(machine) + "\n" + normalized).encode()).hexdigest()
+
+    # Get a cached image, None if there isn't one
+    def get(self, key: str) -> bytes:
+        try:
+            file = open(os.path.join(self.cacheDir, key + '.bin'), 'rb')
+        except FileNotFoundError:
+            return None
+
+        image = file.read()
+        file.close()
+        return image
+
+    # Store an image, written to a temporary file first so a reader never sees half an entry
+    def put(self, key: str, image: bytes):
+        path = os.path.join(self.cacheDir, key + '.bin')
+        file = open(path + '.tmp', 'wb')
+        file.write(image)
+        file.close()
+        os.replace(path + '.tmp', path)
+
+
 def main():
-    # Obtain input and output file names/locations/paths
-    inputFile, outputFile = argParse()
+    # Obtain command line options
+    args = argParse()
+
+    # Keep re-assembling a directory as its files change
+    if args.watch is not None:
+        watch(args.watch, args.out_dir, args.cache_dir, args.interval, args.format, args.machine)
+        return
+
+    # Assemble many files at once across a process pool
+    if args.batch is not None:
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+        results = assembleBatch(expandInputs(args.batch, args.out_dir, IMAGE_EXTENSIONS[args.format]), args.jobs, args.format, args.machine)
+        printBatchResults(results)
+
+        # Every image that assembled, packed back to back in input order
+        if args.archive is not None:
+            try:
+                writeArchive(args.archive, [result.image for result in results if result.succeeded], args.machine)
+            except (OSError, ValueError) as err:
+                printErr("[FAIL] " + args.archive)
+                printErr("\t" + str(err))
+                sys.exit(1)
+            print("Archived " + str(sum(result.succeeded for result in results)) + " images in " + args.archive + "\n")
+
+        if not all(result.succeeded for result in results):
+            sys.exit(1)
+        return
+
+    # Keep running and assemble sources sent over a socket
+    if args.serve is not None:
+        serve(args.serve, args.machine)
+        return
+
+    # Assemble every source sent down stdin, answering each one on stdout
+    if args.framed:
+        assembleFramed(sys.stdin.buffer, sys.stdout.buffer, args.machine, args.format)
+        return
+
+    # Obtain input and output file names/locations/paths, None stands for stdin/stdout
+    inputFile, outputFile = args.inputFile, args.outputFile
 
     # Validate assembly file exsists
-    if not os.path.exists(inputFile.fullPath):
+    if inputFile is not None and not os.path.exists(inputFile.fullPath):
         printErr("[ERROR] File '" + inputFile.fullPath + "' not found!")
         printErr("\tAborting assembly process....\n")
-        exit()
+        sys.exit(1)
 
-    # Create an intermediate file for processing
-    tempName = pathlib.Path(outputFile.fullPath).stem + ".tmp"
-    intermediateFile = FileProps(tempName, outputFile.path, os.path.join(outputFile.path, tempName))
-    shutil.copyfile(inputFile.fullPath, intermediateFile.fullPath)
+    # Assemble a relocatable object module instead of an image, link.py places it and links it with other modules
+    if args.object:
+        try:
+            source = sys.stdin.read() if inputFile is None else readFile(inputFile.fullPath)
+            name = 'stdin' if inputFile is None else pathlib.Path(inputFile.name).stem
+            contents = formatObject(assembleObject(source, name, args.machine)).encode()
+        except AssemblyError as err:
+            printErr(str(err))
+            printErr("\tAborting assembly process....\n")
+            sys.exit(1)
 
-    # Simplify intermediate file to known format
-    # print("Re-formatting file...")
-    stripFile(intermediateFile.fullPath)
+        if outputFile is None:
+            sys.stdout.buffer.write(contents)
+            sys.stdout.flush()
+            return
+        writeBinaryFile(outputFile.fullPath, contents)
+        print("Finsihed assembling: " + outputFile.name + "!\n")
+        return
 
-    # link labels in the intermediate file
-    # print("Linking labels...")
-    labelLink(intermediateFile.fullPath)
+    # Assemble the whole program in memory, the only disk access is the final image
+    try:
+        source = sys.stdin.read() if inputFile is None else readFile(inputFile.fullPath)
+        tokens = labelLink(stripFile(source), args.machine)
+
+        # The optimizer and timing analysis work on one byte instructions only
+        if (args.optimize or args.timing) and args.machine.multiByte:
+            raise AssemblyError("[ERROR] --optimize and --timing only support machines with one byte instructions, '" + args.machine.name + "' has two byte ones!")
+
+        # The optimizer's report goes to stderr when stdout carries the image
+        if args.optimize:
+            tokens, changes = optimize(tokens, args.rom, args.machine)
+            printOptimizations(changes, sys.stdout if outputFile is not None else sys.stderr)
+
+        image = assemble(tokens, args.machine)
+
+        # The timing report goes to stderr when stdout carries the image
+        if args.timing:
+            report = timingReport(tokens, source, args.rom, args.clock, args.machine)
+            print('\n'.join(report) + '\n', file=sys.stdout if outputFile is not None else sys.stderr)
+    except AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting assembly process....\n")
+        sys.exit(1)
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting assembly process....\n")
+        sys.exit(1)
 
-    # Convert intermediate file to machine code
-    # print("Assembling file...")
-    assemble(intermediateFile.fullPath, outputFile.fullPath)
+    # Streaming to stdout, the image is the only thing written there
+    if outputFile is None:
+        sys.stdout.buffer.write(encodeImage(image, args.format))
+        sys.stdout.flush()
+        return
+    writeBinaryFile(outputFile.fullPath, encodeImage(image, args.format))
 
     print("Finsihed assembling: " + outputFile.name + "!\n")
 
 
-# Function for converting the intermediate file to machine code and parsing instructions
-def assemble(intermediateFile: os.path, outputFile: os.path):
-    # At this point in the process, all mnemonics left in the file should strictly be instructions
-    # or set directives at the end of the file. Thus all that's left is to parse instructions and
-    # convert them to their proper machine code
+# Function for assembling a single file from disk into an output image
+# Errors are captured in the returned result rather than ending the process, so this is safe to run in a pool
+def assembleFile(inputFile: str, outputFile: str, imageFormat: str = 'logisim', machine: Machine = DEFAULT_MACHINE) -> AssemblyResult:
+    try:
+        image = assembleSource(readFile(inputFile), machine)
+        writeBinaryFile(outputFile, encodeImage(image, imageFormat))
+    except AssemblyError as err:
+        return AssemblyResult(inputFile, outputFile, False, str(err))
+    except (OSError, ValueError) as err:
+        return AssemblyResult(inputFile, outputFile, False, "[ERROR] " + str(err))
+
+    return AssemblyResult(inputFile, outputFile, True, image=image)
+
+
+# Function for assembling a list of (input, output) file pairs across a pool of processes
+# Returns one result per pair in the same order as the pairs were given
+def assembleBatch(jobs: typing.List[typing.Tuple[str, str]], workers: int = None, imageFormat: str = 'logisim', machine: Machine = DEFAULT_MACHINE) -> typing.List[AssemblyResult]:
+    if len(jobs) == 0:
+        return []
+
+    inputs = [job[0] for job in jobs]
+    outputs = [job[1] for job in jobs]
+    formats = [imageFormat] * len(jobs)
+    machines = [machine] * len(jobs)
+
+    # Not worth spinning up a pool for a single worker or file
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers == 1:
+        return list(map(assembleFile, inputs, outputs, formats, machines))
+
+    # Hand out work in chunks so the pool isn't dominated by per-file messaging
+    chunkSize = max(1, len(jobs) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(assembleFile, inputs, outputs, formats, machines, chunksize=chunkSize))
+
+
+# Function for expanding files, directories and glob patterns into (input, output) file pairs
+# Directories expand to every '.sap' file inside of them
+# Output files are placed next to their input unless an output directory is given
+def expandInputs(patterns: typing.List[str], outputDir: str = None, extension: str = '.bin') -> typing.List[typing.Tuple[str, str]]:
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            inputs += sorted(glob.glob(os.path.join(pattern, '*.sap')))
+        elif glob.has_magic(pattern):
+            inputs += sorted(glob.glob(pattern))
+        else:
+            inputs.append(pattern)
+
+    jobs = []
+    for inputFile in dict.fromkeys(os.path.abspath(inputFile) for inputFile in inputs):
+        outputName = pathlib.Path(inputFile).stem + extension
+        outputPath = os.path.abspath(outputDir) if outputDir else os.path.dirname(inputFile)
+        jobs.append((inputFile, os.path.join(outputPath, outputName)))
+
+    return jobs
+
+
+# Function for printing per file results and a summary of a batch run
+def printBatchResults(results: typing.List[AssemblyResult]):
+    failed = 0
+    for result in results:
+        if result.succeeded:
+            print("[OK]   " + result.inputFile + " -> " + result.outputFile)
+            continue
 
-    # Read all lines of file and store in array for easy modification
-    lines = readFile(intermediateFile)
+        failed += 1
+        printErr("[FAIL] " + result.inputFile)
+        printErr("\t" + result.error.replace("\n", "\n\t"))
+
+    print("\nAssembled " + str(len(results) - failed) + " of " + str(len(results)) + " files, " + str(failed) + " failed\n")
+
+
+# Function for watching a directory and re-assembling '.sap' files as they are saved
+# Only files whose normalized source (the output of stripFile) changed are assembled again,
+# so saving a comment or whitespace change costs nothing. Images are kept in an on-disk cache
+# so unchanged programs are served from it across runs
+def watch(directory: str, outputDir: str = None, cacheDir: str = None, interval: float = 0.5, imageFormat: str = 'logisim', machine: Machine = DEFAULT_MACHINE):
+    cache = AssemblyCache(cacheDir or os.path.join(directory, '.sapcache'))
+    if outputDir is not None:
+        os.makedirs(outputDir, exist_ok=True)
+
+    # Last seen modification stamp and cache key of every file
+    stamps: typing.Dict[str, typing.Tuple[int, int]] = {}
+    keys: typing.Dict[str, str] = {}
+
+    print("Watching '" + directory + "' for changes, press Ctrl+C to stop\n")
+    try:
+        while True:
+            for inputFile, outputFile in expandInputs([directory], outputDir, IMAGE_EXTENSIONS[imageFormat]):
+                try:
+                    stat = os.stat(inputFile)
+                except OSError:
+                    continue
+
+                # Skip anything that hasn't been saved since the last pass
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if stamps.get(inputFile) == stamp:
+                    continue
+                stamps[inputFile] = stamp
+
+                assembleCached(inputFile, outputFile, cache, keys, imageFormat, machine)
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+
+
+# Function for assembling a file through the cache and reporting what happened
+# keys holds the cache key each file was last assembled with, a file with an unchanged key is skipped
+def assembleCached(inputFile: str, outputFile: str, cache: AssemblyCache, keys: typing.Dict[str, str], imageFormat: str = 'logisim', machine: Machine = DEFAULT_MACHINE):
+    try:
+        tokens, normalized = normalizeSource(readFile(inputFile))
+        key = cache.key(normalized, machine)
+        if keys.get(inputFile) == key:
+            return
+        keys[inputFile] = key
+
+        # Serve the image from the cache, only assembling what it hasn't seen before
+        image = cache.get(key)
+        status = "[CACHE]"
+        if image is None:
+            image = assemble(labelLink(tokens, machine), machine)
+            cache.put(key, image)
+            status = "[OK]   "
+
+        writeFileIfChanged(outputFile, encodeImage(image, imageFormat))
+    except AssemblyError as err:
+        printErr("[FAIL] " + inputFile)
+        printErr("\t" + str(err).replace("\n", "\n\t"))
+        return
+    except OSError as err:
+        printErr("[FAIL] " + inputFile)
+        printErr("\t[ERROR] " + str(err))
+        return
+    except ValueError as err:
+        printErr("[FAIL] " + inputFile)
+        printErr("\t[ERROR] " + str(err))
+        return
+
+    print(status + " " + inputFile + " -> " + outputFile)
+
+
+# Function for tokenizing source and rendering the token stream back as text
+# The text is the same for any two sources that only differ in comments, spacing, case or set directive order
+def normalizeSource(source: str) -> typing.Tuple[typing.List[Token], str]:
+    tokens = stripFile(source)
+    return tokens, '\n'.join(str(token) for token in tokens)
+
+
+# Function for getting the version of the assembler, a hash of its own source
+# Cached images are keyed on it so changing the assembler invalidates them
+@functools.lru_cache(maxsize=None)
+def assemblerVersion() -> str:
+    file = open(os.path.abspath(__file__), 'rb')
+    version = hashlib.sha256(file.read()).hexdigest()
+    file.close()
+    return version
+
+
+# Function for running the full assembly pipeline on source text
+# The source is tokenized once by stripFile and every later stage works on that token stream
+# Returns the program RAM image as bytes
+def assembleSource(source: str, machine: Machine = DEFAULT_MACHINE) -> bytes:
+    return assemble(labelLink(stripFile(source), machine), machine)
+
+
+# Function for converting the linked token stream to machine code and parsing instructions
+def assemble(tokens: typing.List[Token], machine: Machine = DEFAULT_MACHINE) -> bytes:
+    # At this point in the process, all mnemonics left in the stream should strictly be instructions
+    # or set directives at the end of the stream. Thus all that's left is to parse instructions and
+    # convert them to their proper machine code
 
     # Create an array that represents the CPU's RAM to store the program in
-    program = ['00'] * 16
+    program = bytearray(machine.ramSize)
 
     # Store the last address of the program section of RAM, useful for detecting erroneous 'set' writes to program data
     programEndAddress = 0
 
-    # Assemble the file line by line
-    for address, line in enumerate(lines):
-        programEndAddress, program = convertInstruction(line, address, programEndAddress, program)
-    
-    # Write the final program RAM to the output file
-    file = open(outputFile, 'w')
+    # Assemble the stream token by token, each instruction goes right after the last byte of the one before it
+    address = 0
+    for token in tokens:
+        try:
+            programEndAddress, program = convertInstruction(token, address, programEndAddress, program, machine)
+        except AssemblyError as err:
+            err.lineNumber = token.lineNumber
+            raise
+        address = programEndAddress + 1
+
+    return bytes(program)
+
+
+# Function for assembling source into a relocatable object module
+# Instructions are assembled as if the module started at address 0, every operand that refers to a label is left as 0
+# and gets a relocation instead, labels the module doesn't define are left for the linker to find in another module
+# 'set' directives are kept as they are and applied at link time, they may refer to labels too
+def assembleObject(source: str, name: str, machine: Machine = DEFAULT_MACHINE) -> ObjectModule:
+    program, symbols = defineLabels(stripFile(source), machine)
+
+    code = bytearray(machine.ramSize)
+    relocations: typing.List[Relocation] = []
+    directives: typing.List[DataDirective] = []
+    address = 0
+    for token in program:
+        try:
+            # Labels become 0 so the line assembles, the relocation fills the real value in later
+            references = [relocatableOperand(arg, token) for arg in token.args]
+            linked = Token(token.mnemonic, ['0x0' if symbol is not None else arg for arg, (symbol, _) in zip(token.args, references)], token.lineNumber)
+
+            if token.mnemonic == 'set':
+                validateNumArgs(token, 2)
+                values = validateArgs(linked, [range(0, machine.ramSize), range(0, 256)])
+                setAddress, value = [reference if reference[0] is not None else (None, number) for reference, number in zip(references, values)]
+                directives.append(DataDirective(setAddress, value, token.lineNumber))
+                continue
+
+            end, code = convertInstruction(linked, address, address, code, machine)
+        except AssemblyError as err:
+            err.lineNumber = token.lineNumber
+            raise
+
+        for symbol, addend in references:
+            if symbol is not None:
+                relocations.append(Relocation(end, symbol, addend, operandRange(token.mnemonic, machine).stop, token.lineNumber))
+        address = end + 1
+
+    return ObjectModule(name, machine, objectKey(source, machine), bytes(code[:address]), symbols, relocations, directives)
+
+
+# Function for splitting an operand into the label it refers to and a number added to it
+# An object module can only relocate a single label plus or minus a number, e.g. 'loop', 'data+1' or 'table-0x2'
+# Returns (None, 0) for a plain number, those are checked by validateArgs like any other operand
+def relocatableOperand(arg: str, token: Token) -> typing.Tuple[str, int]:
+    terms = re.split(r'([+-])', arg)
+    if len(terms) == 1 and not isLabelName(arg):
+        return None, 0
+
+    symbol = None
+    addend = 0
+    sign = 1
+    for i, term in enumerate(terms):
+        if i == 0 and term == '':
+            continue
+
+        if term == '+' or term == '-':
+            sign = 1 if term == '+' else -1
+            continue
+
+        if isLabelName(term):
+            if symbol is not None or sign < 0:
+                raise AssemblyError("[ERROR] The operand '" + arg + "' can't be relocated, an object can only add a number to a single label!\n\n" +
+                                     "\tLine " + str(token.lineNumber) + ": " + str(token), token.lineNumber)
+            symbol = term
+            continue
+
+        try:
+            addend += sign * int(term, 0)
+        except ValueError:
+            raise AssemblyError("[ERROR] The term '" + term + "' in '" + arg + "' is not a valid integer!\n\n" +
+                                 "\tLine " + str(token.lineNumber) + ": " + str(token), token.lineNumber)
+
+    return symbol, addend
+
+
+# Function for getting the key an object is stored under, any change to the source's tokens, the assembler or machine changes it
+# Like the watch cache it hashes the normalized source, so comment and spacing changes keep the object
+# Objects record line numbers for the linker's errors, so each token's line is part of the key as well
+def objectKey(source: str, machine: Machine = DEFAULT_MACHINE) -> str:
+    normalized = '\n'.join(str(token.lineNumber) + " " + str(token) for token in stripFile(source))
+    return hashlib.sha256((assemblerVersion() + "\n" + repr(machine) + "\n" + normalized).encode()).hexdigest()
+
+
+# Function for formatting an object module as an object file, one line of JSON with the code as a hex string
+def formatObject(module: ObjectModule) -> str:
+    fields = dataclasses.asdict(module)
+    fields["code"] = module.code.hex()
+    return json.dumps({"format": OBJECT_FORMAT, **fields}) + "\n"
+
+
+# Function for reading an object file back into an object module
+def parseObject(text: str) -> ObjectModule:
+    try:
+        fields = json.loads(text)
+        if fields.get("format") != OBJECT_FORMAT:
+            raise ValueError("object format " + str(fields.get("format")) + " is not " + str(OBJECT_FORMAT))
+
+        return ObjectModule(fields["name"], Machine(**fields["machine"]), fields["key"], bytes.fromhex(fields["code"]), fields["symbols"],
+                            [Relocation(**relocation) for relocation in fields["relocations"]],
+                            [DataDirective(tuple(directive["address"]), tuple(directive["value"]), directive["lineNumber"]) for directive in fields["directives"]])
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        raise AssemblyError("[ERROR] Not a valid object file: " + str(err))
+
+
+# Function for getting the T-states every instruction takes, read from the microcode ROM
+# Every instruction runs the two hardwired fetch steps and then its own steps up to and including the first NXT (or HLT)
+# The ROM is laid out for the machine, every opcode gets 2**stepBits words
+# Returns a dictionary of mnemonic -> T-states
+@functools.lru_cache(maxsize=None)
+def instructionCycles(romPath: str = DEFAULT_ROM, machine: Machine = DEFAULT_MACHINE) -> typing.Dict[str, int]:
+    # The generator's file name isn't a valid module name, so it has to be loaded from its path
+    spec = importlib.util.spec_from_file_location("micro_code_generator", os.path.join(ROOT_DIR, "micro-code_generator.py"))
+    generator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generator)
+
+    rom = readRomWords(romPath)
+    if len(rom) > machine.romSize:
+        raise AssemblyError("[ERROR] '" + str(romPath) + "' has " + str(len(rom)) + " words, more than the " + str(machine.romSize) + " of a microcode ROM for '" + machine.name + "'!")
+    rom += [0] * (machine.romSize - len(rom))
+
+    cycles = {}
+    for mnemonic, opcode in generator.instructions.items():
+        steps = len(generator.FETCH)
+        for step in range(len(generator.FETCH), machine.steps):
+            steps += 1
+            if rom[opcode << machine.stepBits | step] & (generator.NXT | generator.HLT):
+                break
+        cycles[mnemonic.lower()] = steps
+
+    return cycles
+
+
+# Function for reading the words of a Logisim 'v3.0 hex words' ROM file, plain or addressed
+def readRomWords(filePath: os.path) -> typing.List[int]:
+    lines = readFile(filePath).splitlines()
+    if not lines or not lines[0].startswith('v3.0 hex words'):
+        raise AssemblyError("[ERROR] '" + str(filePath) + "' is not a Logisim 'v3.0 hex words' file!")
+
+    words = []
+    for line in lines[1:]:
+        parts = line.split('#', 1)[0].split()
+
+        # Addressed files start every line with the address of its first word
+        if lines[0].endswith('addressed') and parts:
+            address = int(parts.pop(0).rstrip(':'), 16)
+            words += [0] * (address - len(words))
+
+        # Runs of the same word are written as count*word
+        for part in parts:
+            count, _, word = part.rpartition('*')
+            words += [int(word, 16)] * int(count or '1')
+
+    return words
+
+
+# Peephole optimizer, runs on the linked token stream right before it is converted to machine code
+# Each pass makes one change and the passes repeat until nothing is left to do:
+#   - jumps to a 'jmp' go straight to where that 'jmp' goes (jump threading)
+#   - 'nop' is removed, unless the program uses it as a variable
+#   - jumps to the very next address are removed
+#   - 'lda X' right after 'sta X' is removed, A already holds X and LDA doesn't touch the flags
+# Removing an instruction moves everything after it, so every operand pointing into the program is re-resolved
+# Data set by 'set' directives is at a fixed address and never moves
+# Programs that read or write their own instructions are left untouched, the bytes themselves would change
+# The cycles each change saves are read from the microcode ROM, see instructionCycles
+# Returns the optimized token stream along with every change made
+def optimize(tokens: typing.List[Token], romPath: str = DEFAULT_ROM, machine: Machine = DEFAULT_MACHINE) -> typing.Tuple[typing.List[Token], typing.List[Optimization]]:
+    code = [token for token in tokens if token.mnemonic != 'set']
+    directives = [token for token in tokens if token.mnemonic == 'set']
+    cycles = instructionCycles(romPath, machine)
+    changes: typing.List[Optimization] = []
+
+    operand = lambda token: int(token.args[0], 16)
+    if any(operand(token) < len(code) and code[operand(token)].mnemonic != 'nop' for token in code if token.mnemonic in MEMORY_MNEMONICS):
+        return tokens, changes
+
+    # Same goes for programs that can run past their last instruction, they execute data as instructions
+    if any(address >= len(code) for address in reachableAddresses(code)):
+        return tokens, changes
+
+    while True:
+        variables = {operand(token) for token in code if token.mnemonic in MEMORY_MNEMONICS}
+        targets = {operand(token) for token in code if token.mnemonic in JUMP_MNEMONICS}
+
+        # Thread jumps, following chains of 'jmp' but never around a loop of them
+        # Only code that can run saves cycles, a jump that never runs (or a 'jmp' nothing reaches any more since a jump was threaded past it) only saves bytes
+        threaded = False
+        reachable = reachableAddresses(code)
+        for address, token in enumerate(code):
+            if token.mnemonic not in JUMP_MNEMONICS:
+                continue
+
+            target = operand(token)
+            seen = set()
+            while target < len(code) and code[target].mnemonic == 'jmp' and target not in seen:
+                seen.add(target)
+                target = operand(code[target])
+
+            if target != operand(token):
+                changes.append(Optimization("'" + str(token) + "' threaded to " + hex(target), token.lineNumber, 0, cycles['jmp'] * len(seen) if address in reachable else 0))
+                token.args = [hex(target)]
+                threaded = True
+
+                # Threading can leave a later 'jmp' with nothing reaching it, it mustn't be credited with cycles any more
+                reachable = reachableAddresses(code)
+
+        # Find a single instruction to remove
+        removable = None
+        for address, token in enumerate(code):
+            if token.mnemonic == 'nop' and address not in variables:
+                removable = address, "removed 'nop'"
+            elif token.mnemonic in JUMP_MNEMONICS and operand(token) == address + 1:
+                removable = address, "removed '" + str(token) + "', it jumps to the next address"
+            elif token.mnemonic == 'lda' and address > 0 and address not in targets and str(code[address - 1]) == 'sta ' + token.args[0]:
+                removable = address, "removed '" + str(token) + "', A already holds it from the 'sta' before"
+
+            if removable is not None:
+                break
+
+        if removable is None:
+            if not threaded:
+                break
+            continue
+
+        address, description = removable
+        reachable = reachableAddresses(code)
+        token = code.pop(address)
+        changes.append(Optimization(description, token.lineNumber, 1, cycles[token.mnemonic] if address in reachable else 0))
+
+        # Re-resolve every operand pointing past the removed instruction, a jump to it now lands on the one after it
+        for other in code:
+            if other.mnemonic in MEMORY_MNEMONICS + JUMP_MNEMONICS and address < operand(other) <= len(code):
+                other.args = [hex(operand(other) - 1)]
+
+    return code + directives, changes
+
+
+# Function for finding every address execution can reach when starting from address 0
+# Conditional jumps are assumed to go both ways, an address past the end of the code means execution runs into data
+def reachableAddresses(code: typing.List[Token]) -> typing.Set[int]:
+    reached = set()
+    pending = [0]
+    while pending:
+        address = pending.pop()
+        if address in reached:
+            continue
+        reached.add(address)
+        if address >= len(code):
+            continue
+
+        token = code[address]
+        if token.mnemonic in JUMP_MNEMONICS:
+            pending.append(int(token.args[0], 16))
+        if token.mnemonic not in ('jmp', 'hlt'):
+            pending.append(address + 1)
+
+    return reached
+
+
+# Function for printing what the optimizer did
+def printOptimizations(changes: typing.List[Optimization], file: typing.TextIO = sys.stdout):
+    for change in changes:
+        print("\tLine " + str(change.lineNumber) + ": " + change.description, file=file)
+
+    print("Optimized: saved " + str(sum(change.bytesSaved for change in changes)) + " byte(s) and " +
+          str(sum(change.cyclesSaved for change in changes)) + " cycle(s) each time the changed code runs\n", file=file)
+
+
+# Function for splitting the program into basic blocks, the nodes of its control flow graph
+# A block starts at address 0, at every jump target and right after every jump
+# Successors are the start addresses of the blocks execution can go to next, an address past the program means it runs into data
+# Returns only the blocks reachable from address 0, keyed by their start address
+def buildBlocks(code: typing.List[Token], cycles: typing.Dict[str, int]) -> typing.Dict[int, BasicBlock]:
+    leaders = {0}
+    for address, token in enumerate(code):
+        if token.mnemonic in JUMP_MNEMONICS:
+            leaders.add(int(token.args[0], 16))
+            leaders.add(address + 1)
+
+    blocks: typing.Dict[int, BasicBlock] = {}
+    pending = [0]
+    while pending:
+        start = pending.pop()
+        if start in blocks or start >= len(code):
+            continue
+
+        end = start
+        while end + 1 < len(code) and end + 1 not in leaders and code[end].mnemonic not in JUMP_MNEMONICS + ('hlt',):
+            end += 1
+
+        last = code[end]
+        successors = []
+        if last.mnemonic in JUMP_MNEMONICS:
+            successors.append(int(last.args[0], 16))
+        if last.mnemonic not in ('jmp', 'hlt'):
+            successors.append(end + 1)
+
+        blocks[start] = BasicBlock(start, end, sum(cycles[token.mnemonic] for token in code[start:end + 1]), successors)
+        pending += successors
 
-    # Write header
-    file.write('v3.0 hex words plain\n')
+    return blocks
 
-    # Write program
-    for line in program:
-        file.write(line + " ")
 
+# Function for finding the fewest and the most cycles from the start of the program to a 'hlt'
+# Returns (best, worst), best is None if no 'hlt' can be reached and worst is None if a loop makes it unbounded
+def pathBounds(blocks: typing.Dict[int, BasicBlock], code: typing.List[Token]) -> typing.Tuple[int, int]:
+    halts = lambda block: code[block.end].mnemonic == 'hlt'
+
+    # Fewest cycles, Dijkstra's algorithm over the block costs
+    best = None
+    distances = {0: blocks[0].cycles}
+    queue = [(blocks[0].cycles, 0)]
+    while queue:
+        distance, start = min(queue)
+        queue.remove((distance, start))
+        if distance > distances[start]:
+            continue
+        if halts(blocks[start]):
+            best = distance
+            break
+
+        for successor in blocks[start].successors:
+            if successor in blocks and distance + blocks[successor].cycles < distances.get(successor, distance + blocks[successor].cycles + 1):
+                distances[successor] = distance + blocks[successor].cycles
+                queue.append((distances[successor], successor))
+
+    return best, longestPath(blocks, 0, halts)
+
+
+# Function for finding the most cycles from a block to one accepted by the end check
+# Returns None if a loop can be taken on the way, then there is no bound, and -1 if no accepted block can be reached
+def longestPath(blocks: typing.Dict[int, BasicBlock], start: int, isEnd: typing.Callable) -> int:
+    longest: typing.Dict[int, int] = {}
+    visiting = set()
+    unbounded = False
+
+    def visit(node: int) -> int:
+        nonlocal unbounded
+        if node in longest:
+            return longest[node]
+        if node in visiting:
+            unbounded = True
+            return -1
+
+        visiting.add(node)
+        block = blocks[node]
+        result = block.cycles if isEnd(block) else -1
+        if not isEnd(block):
+            for successor in block.successors:
+                if successor in blocks:
+                    rest = visit(successor)
+                    if rest >= 0:
+                        result = max(result, block.cycles + rest)
+        visiting.remove(node)
+
+        longest[node] = result
+        return result
+
+    result = visit(start)
+    return None if unbounded else result
+
+
+# Function for finding the natural loops of the control flow graph and the cycles one trip around each costs
+# A loop is formed by an edge back to a block that every path to it has to go through (its header)
+def findLoops(blocks: typing.Dict[int, BasicBlock]) -> typing.List[Loop]:
+    # Dominators, the blocks every path from the start has to go through to get to a block
+    predecessors = {start: [other for other in blocks if start in blocks[other].successors] for start in blocks}
+    dominators = {start: set(blocks) for start in blocks}
+    dominators[0] = {0}
+    changed = True
+    while changed:
+        changed = False
+        for start in blocks:
+            if start == 0:
+                continue
+            dominated = set.intersection(*(dominators[other] for other in predecessors[start])) | {start}
+            if dominated != dominators[start]:
+                dominators[start] = dominated
+                changed = True
+
+    loops = []
+    for latch in blocks:
+        for header in blocks[latch].successors:
+            if header not in dominators[latch]:
+                continue
+
+            # The loop body is every block that can get to the latch without going through the header
+            body = {header, latch}
+            pending = [latch]
+            while pending:
+                for other in predecessors[pending.pop()]:
+                    if other not in body:
+                        body.add(other)
+                        pending.append(other)
+
+            # One trip goes from the header to the latch and takes the edge back, inner loops leave the most unbounded
+            inside = {start: BasicBlock(block.start, block.end, block.cycles, [successor for successor in block.successors if successor in body and successor != header])
+                      for start, block in blocks.items() if start in body}
+            isLatch = lambda block: block.start == latch
+            maxCycles = longestPath(inside, header, isLatch)
+            minCycles = shortestPath(inside, header, latch)
+            loops.append(Loop(header, sorted(body), minCycles, maxCycles))
+
+    return sorted(loops, key=lambda loop: loop.header)
+
+
+# Function for finding the fewest cycles from one block to another, both blocks included
+def shortestPath(blocks: typing.Dict[int, BasicBlock], start: int, end: int) -> int:
+    distances = {start: blocks[start].cycles}
+    pending = [start]
+    while pending:
+        node = pending.pop()
+        for successor in blocks[node].successors:
+            if successor not in blocks:
+                continue
+            distance = distances[node] + blocks[successor].cycles
+            if distance < distances.get(successor, distance + 1):
+                distances[successor] = distance
+                pending.append(successor)
+
+    return distances.get(end)
+
+
+# Function for building the static timing report of a program, every count is in T-states (clock cycles)
+# Covers every instruction, every basic block, the bounds on a run from the start to 'hlt' and one trip around every loop
+# Returns the report as lines of text
+def timingReport(tokens: typing.List[Token], source: str, romPath: str = DEFAULT_ROM, clock: float = None, machine: Machine = DEFAULT_MACHINE) -> typing.List[str]:
+    cycles = instructionCycles(romPath, machine)
+    code = [token for token in tokens if token.mnemonic != 'set']
+    text = source.splitlines()
+    seconds = lambda count: "" if clock is None or count is None else f' ({count / clock * 1e6:.2f} us at {clock:g} Hz)'
+
+    report = ["Timing from '" + str(romPath) + "', fetch steps included", "", "  addr  line  cycles  source"]
+    for address, token in enumerate(code):
+        report.append(f'  {address:#4x}  {token.lineNumber:4d}  {cycles[token.mnemonic]:6d}  ' + text[token.lineNumber - 1].strip())
+
+    if not code:
+        return report
+
+    blocks = buildBlocks(code, cycles)
+    report += ["", "  block      lines    cycles  next"]
+    for start, block in sorted(blocks.items()):
+        following = ', '.join(f'{successor:#x}' if successor < len(code) else 'data' for successor in block.successors) or 'halt'
+        lines = str(code[block.start].lineNumber) + "-" + str(code[block.end].lineNumber)
+        report.append(f'  {block.start:#x}-{block.end:#x}  {lines:>9s}  {block.cycles:6d}  ' + following)
+
+    best, worst = pathBounds(blocks, code)
+    intoData = any(successor >= len(code) for block in blocks.values() for successor in block.successors)
+    report.append("")
+    if intoData:
+        report.append("Execution can run past the last instruction into data, the bounds only cover paths that stay in the program")
+    if best is None:
+        report.append("No path from the start reaches 'hlt'" + ("" if intoData else ", the program never halts"))
+    else:
+        report.append("Fewest cycles to halt: " + str(best) + seconds(best))
+        report.append("Most cycles to halt:   " + (str(worst) + seconds(worst) if worst is not None else "unbounded, depends on how many times the loops run"))
+
+    for loop in findLoops(blocks):
+        most = str(loop.maxCycles) if loop.maxCycles is not None else "unbounded (inner loop)"
+        report.append(f'Loop at {loop.header:#x} (line {code[loop.header].lineNumber}), blocks ' + ', '.join(f'{start:#x}' for start in loop.blocks) +
+                      ": " + str(loop.minCycles) + " to " + most + " cycles per trip" + seconds(loop.minCycles))
+
+    return report
+
+
+# Function for assembling many sources sent down one stream, see assembleFrame for the protocol
+# Runs until the input stream ends, a malformed frame header ends the process as the stream can't be followed past it
+def assembleFramed(inStream: typing.BinaryIO, outStream: typing.BinaryIO, machine: Machine = DEFAULT_MACHINE, imageFormat: str = 'logisim'):
+    while True:
+        header = inStream.readline()
+        if header == b'':
+            return
+
+        # Blank lines between frames are allowed, it makes the protocol easy to drive by hand
+        if header.strip() == b'':
+            continue
+
+        try:
+            length = int(header)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            printErr("[ERROR] Malformed frame header: " + repr(header))
+            printErr("\tAborting assembly process....\n")
+            sys.exit(1)
+
+        source = inStream.read(length)
+        if len(source) != length:
+            printErr("[ERROR] Stream ended in the middle of a frame, expected " + str(length) + " bytes but got " + str(len(source)))
+            printErr("\tAborting assembly process....\n")
+            sys.exit(1)
+
+        outStream.write(assembleFrame(source, machine, imageFormat))
+        outStream.flush()
+
+
+# Function for assembling a single framed source
+# Framing protocol, every frame is a decimal byte count on its own line followed by exactly that many bytes:
+#   request  -> '<length>\n' + UTF-8 assembly source
+#   response -> 'ok <length>\n' + the image in the chosen format, or 'error <length>\n' + the error report
+def assembleFrame(source: bytes, machine: Machine = DEFAULT_MACHINE, imageFormat: str = 'logisim') -> bytes:
+    try:
+        status, body = b'ok', encodeImage(assembleSource(source.decode(), machine), imageFormat)
+    except AssemblyError as err:
+        status, body = b'error', str(err).encode()
+    except UnicodeDecodeError as err:
+        status, body = b'error', ("[ERROR] Source is not valid UTF-8: " + str(err)).encode()
+    except ValueError as err:
+        status, body = b'error', ("[ERROR] " + str(err)).encode()
+
+    return status + b' ' + str(len(body)).encode() + b'\n' + body
+
+
+# Function for running the assembler as a long lived server, so clients don't pay for a process start per program
+# The address is either a Unix socket path (anything with a '/', or 'unix:<path>') or '[host:]port' on TCP, localhost by default
+# Protocol, one JSON object per line each way:
+#   request  -> {"id": <anything>, "source": "<assembly source>"}
+#   response -> {"id": <same>, "ok": true, "image": [one number per byte of RAM]}
+#               {"id": <same>, "ok": false, "error": {"message": "<error report>", "line": <line number or null>}}
+def serve(address: str, machine: Machine = DEFAULT_MACHINE):
+    try:
+        asyncio.run(runServer(address, machine))
+    except KeyboardInterrupt:
+        print("\nServer stopped")
+
+
+async def runServer(address: str, machine: Machine = DEFAULT_MACHINE):
+    # Sources are tiny but the default line limit of 64KiB would still cut off large generated ones
+    limit = 1 << 24
+
+    client = functools.partial(handleClient, machine=machine)
+    path = None
+    if address.startswith('unix:') or '/' in address:
+        path = address.removeprefix('unix:')
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(client, path, limit=limit)
+    else:
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(client, host or '127.0.0.1', int(port), limit=limit)
+
+    print("Serving on " + ', '.join(str(sock.getsockname()) for sock in server.sockets) + ", press Ctrl+C to stop\n")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # Don't leave a stale socket file behind
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+# Handle one client connection, requests are answered in order until the client disconnects
+async def handleClient(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, machine: Machine = DEFAULT_MACHINE):
+    try:
+        while True:
+            line = await reader.readline()
+            if line == b'':
+                break
+            if line.strip() == b'':
+                continue
+
+            writer.write(json.dumps(serveRequest(line, machine)).encode() + b'\n')
+            await writer.drain()
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+# Function for answering a single server request
+# Assembling takes microseconds, so it is done right on the event loop
+def serveRequest(line: bytes, machine: Machine = DEFAULT_MACHINE) -> dict:
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or not isinstance(request.get('source'), str):
+            raise ValueError("expected an object with a 'source' string")
+    except ValueError as err:
+        return {"id": None, "ok": False, "error": {"message": "[ERROR] Malformed request: " + str(err), "line": None}}
+
+    response = {"id": request.get('id')}
+    try:
+        response.update(ok=True, image=list(assembleSourceCached(request['source'], machine)))
+    except AssemblyError as err:
+        response.update(ok=False, error={"message": str(err), "line": err.lineNumber})
+    except Exception as err:
+        # One bad program must never take the server down for every other client
+        response.update(ok=False, error={"message": "[ERROR] Internal assembler error: " + repr(err), "line": None})
+    return response
+
+
+# Clients such as test harnesses send the same programs over and over, assembled images are remembered
+@functools.lru_cache(maxsize=4096)
+def assembleSourceCached(source: str, machine: Machine = DEFAULT_MACHINE) -> bytes:
+    return assembleSource(source, machine)
+
+
+# Function for formatting a program RAM image as a Logisim 'v3.0 hex words plain' file
+def formatImage(image: bytes) -> str:
+    return 'v3.0 hex words plain\n' + ''.join(f'{byte:02x} ' for byte in image)
+
+
+# Function for formatting a program RAM image as Intel HEX, one data record per 16 bytes and the end of file record
+def formatIntelHex(image: bytes) -> str:
+    records = []
+    for address in range(0, len(image), 16):
+        data = bytes(image[address:address + 16])
+        record = bytes([len(data), address >> 8, address & 0xff, 0x00]) + data
+        records.append(':' + record.hex().upper() + f'{-sum(record) & 0xff:02X}\n')
+
+    return ''.join(records) + ':00000001FF\n'
+
+
+# Function for encoding a program RAM image in one of the output formats
+#   logisim -> 'v3.0 hex words plain' text, what the circuit loads
+#   raw     -> the bytes of RAM and nothing else
+#   ihex    -> Intel HEX, for EEPROM programmers
+def encodeImage(image: bytes, imageFormat: str = 'logisim') -> bytes:
+    match imageFormat:
+        case 'logisim':
+            return formatImage(image).encode()
+        case 'raw':
+            return bytes(image)
+        case 'ihex':
+            return formatIntelHex(image).encode()
+
+    raise ValueError("Unknown image format '" + imageFormat + "'")
+
+
+# Function for reading a program RAM image written in any of the output formats, see guessImageFormat when none is given
+# Images shorter than the machine's RAM are padded with zeros
+def readImage(filePath: os.path, machine: Machine = DEFAULT_MACHINE, imageFormat: str = None) -> bytes:
+    data = readBinaryFile(filePath)
+
+    match imageFormat or guessImageFormat(filePath, data):
+        case 'logisim':
+            words = readRomWords(filePath)
+        case 'ihex':
+            try:
+                words = parseIntelHex(data.decode('ascii'))
+            except (UnicodeDecodeError, ValueError) as err:
+                raise ValueError("Image '" + str(filePath) + "' is not valid Intel HEX: " + str(err))
+        case 'raw':
+            words = list(data)
+        case _:
+            raise ValueError("Unknown image format '" + imageFormat + "'")
+
+    if len(words) > machine.ramSize or any(word > 0xff for word in words):
+        raise ValueError("Image '" + str(filePath) + "' is not a " + str(machine.ramSize) + " byte RAM image")
+    return bytes(words + [0] * (machine.ramSize - len(words)))
+
+
+# Function for telling which format an image file is in
+#   '.hex' files are Intel HEX and files starting with the Logisim header are Logisim images, anything else is raw
+#   A raw image can start with any byte (':' is 'sub 0xa'), so a file that only looks like Intel HEX is read as raw unless it parses
+def guessImageFormat(filePath: os.path, data: bytes) -> str:
+    if pathlib.Path(filePath).suffix.lower() == IMAGE_EXTENSIONS['ihex']:
+        return 'ihex'
+    if data.startswith(b'v3.0 hex words'):
+        return 'logisim'
+
+    if data.startswith(b':'):
+        try:
+            parseIntelHex(data.decode('ascii'))
+            return 'ihex'
+        except (UnicodeDecodeError, ValueError):
+            pass
+    return 'raw'
+
+
+# Function for parsing Intel HEX data records, checksums are checked and everything after the end of file record is ignored
+def parseIntelHex(text: str) -> typing.List[int]:
+    memory: typing.Dict[int, int] = {}
+    for line in text.split():
+        record = bytes.fromhex(line.lstrip(':'))
+        if len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xff:
+            raise ValueError("Bad Intel HEX record '" + line + "'")
+
+        kind = record[3]
+        if kind == 0x01:
+            break
+        if kind != 0x00:
+            raise ValueError("Unsupported Intel HEX record type " + str(kind))
+
+        address = record[1] << 8 | record[2]
+        for offset, byte in enumerate(record[4:-1]):
+            memory[address + offset] = byte
+
+    return [memory.get(address, 0) for address in range(max(memory, default=-1) + 1)]
+
+
+class ImageArchive:
+    """Read only view of many raw RAM images packed back to back in one file, as written by writeArchive
+
+    The file is memory mapped, so opening an archive of millions of images costs nothing
+    and every image is a memoryview straight into the mapping, nothing is parsed or copied
+    """
+
+    def __init__(self, filePath: os.path, machine: Machine = DEFAULT_MACHINE):
+        # Every image is a whole RAM of the machine the archive was written for
+        self.imageSize = machine.ramSize
+
+        self.file = open(filePath, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % self.imageSize:
+            self.file.close()
+            raise ValueError("Archive '" + str(filePath) + "' is " + str(size) + " bytes, not a whole number of " + str(self.imageSize) + " byte images")
+
+        # An empty file can't be mapped, but an empty archive is still a valid one
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self.map) if size else memoryview(b'')
+
+    def __len__(self) -> int:
+        return len(self.view) // self.imageSize
+
+    def __getitem__(self, index: int) -> memoryview:
+        if not -len(self) <= index < len(self):
+            raise IndexError("Image " + str(index) + " is out of range")
+
+        start = (index % len(self)) * self.imageSize
+        return self.view[start:start + self.imageSize]
+
+    def __iter__(self) -> typing.Iterator[memoryview]:
+        for start in range(0, len(self.view), self.imageSize):
+            yield self.view[start:start + self.imageSize]
+
+    def __enter__(self) -> 'ImageArchive':
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Release the mapping, any image still held from it has to be released first
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+# Function for writing images back to back into a raw archive, ImageArchive reads them back
+# Every image is checked before anything is written, so a bad one never leaves a partial archive behind
+def writeArchive(filePath: os.path, images: typing.Iterable[bytes], machine: Machine = DEFAULT_MACHINE):
+    images = list(images)
+    for index, image in enumerate(images):
+        if len(image) != machine.ramSize:
+            raise ValueError("Image " + str(index) + " is " + str(len(image)) + " bytes, images archived for '" + machine.name + "' have to be exactly " + str(machine.ramSize) + " bytes")
+
+    file = open(filePath, 'wb')
+    for image in images:
+        file.write(image)
     file.close()
-          
+
 
 # Function for converting an instruction to it's machinecode representation and validating it
 # Returns the modified program array as we need the full array for the 'set' directives
-def convertInstruction(line: str, address: int, programEndAddress: int, program: typing.List[int]) -> typing.Tuple[int, typing.List[str]]:
-    # Get the mnemonic from the line
-    mnemonic = line.split(None, 1)[0]
-    machineCode = ''
+def convertInstruction(token: Token, address: int, programEndAddress: int, program: bytearray, machine: Machine = DEFAULT_MACHINE) -> typing.Tuple[int, bytearray]:
+    # Get the mnemonic from the token
+    mnemonic = token.mnemonic
+    machineCode = b''
+
+    # Operands are RAM addresses, see operandRange for the one exception
+    ranges = [machine.addressRange]
 
     # Error on reserved instructions
-    if 'res' in mnemonic.lower():
-        printErr("[ERROR] Instruction '" + mnemonic + "' is reserved and should not be used!")
-        printErr("\tAborting assembly process....\n")
-        exit()
+    if 'res' in mnemonic:
+        raise AssemblyError("[ERROR] Instruction '" + mnemonic + "' is reserved and should not be used!")
 
     # map mnemonics to machine code
-    match mnemonic.lower():
+    match mnemonic:
         case 'nop':
-            machineCode = generateMachineCode(int('0000', 2), line)
+            machineCode = generateMachineCode(int('0000', 2), token, machine=machine)
 
         case 'lda':
-            machineCode = generateMachineCode(int('0001', 2), line, 1, [range(0, 16)])
+            machineCode = generateMachineCode(int('0001', 2), token, 1, ranges, machine)
 
         case 'add':
-            machineCode = generateMachineCode(int('0010', 2), line, 1, [range(0, 16)])
+            machineCode = generateMachineCode(int('0010', 2), token, 1, ranges, machine)
 
         case 'sub':
-            machineCode = generateMachineCode(int('0011', 2), line, 1, [range(0, 16)])
+            machineCode = generateMachineCode(int('0011', 2), token, 1, ranges, machine)
 
         case 'sta':
-            machineCode = generateMachineCode(int('0100', 2), line, 1, [range(0, 16)])
+            machineCode = generateMachineCode(int('0100', 2), token, 1, ranges, machine)
 
         case 'ldi':
-            machineCode = generateMachineCode(int('0101', 2), line, 1, [range(0, 8)])
+            machineCode = generateMachineCode(int('0101', 2), token, 1, [operandRange(mnemonic, machine)], machine)
 
         case 'jmp':
-            machineCode = generateMachineCode(int('0110', 2), line, 1, [range(0, 16)])
+            machineCode = generateMachineCode(int('0110', 2), token, 1, ranges, machine)
 
         case 'jc':
-            machineCode = generateMachineCode(int('0111', 2), line, 1, [range(0,16)])
+            machineCode = generateMachineCode(int('0111', 2), token, 1, ranges, machine)
 
         case 'jz':
-            machineCode = generateMachineCode(int('1000', 2), line, 1, [range(0,16)])
+            machineCode = generateMachineCode(int('1000', 2), token, 1, ranges, machine)
 
 
         case 'res6':
-            machineCode = generateMachineCode(int('1001', 2), line)
+            machineCode = generateMachineCode(int('1001', 2), token, machine=machine)
         case 'res7':
-            machineCode = generateMachineCode(int('1010', 2), line)
+            machineCode = generateMachineCode(int('1010', 2), token, machine=machine)
         case 'res8':
-            machineCode = generateMachineCode(int('1011', 2), line)
+            machineCode = generateMachineCode(int('1011', 2), token, machine=machine)
         case 'res9':
-            machineCode = generateMachineCode(int('1100', 2), line)
+            machineCode = generateMachineCode(int('1100', 2), token, machine=machine)
 
 
         case 'clr':
-            machineCode = generateMachineCode(int('1101', 2), line)
+            machineCode = generateMachineCode(int('1101', 2), token, machine=machine)
 
         case 'out':
-            machineCode = generateMachineCode(int('1110', 2), line)
+            machineCode = generateMachineCode(int('1110', 2), token, machine=machine)
 
         case 'hlt':
-            machineCode = generateMachineCode(int('1111', 2), line)
+            machineCode = generateMachineCode(int('1111', 2), token, machine=machine)
 
         # Take care of the assembly directive 'set'
         case 'set':
-            validateNumArgs(line, 2)
-            args = validateArgs(line, [range(0, 16), range(0, 256)])
-            setAddress, value = int(''.join(('0x', args[:1])), 16), int(''.join(('0x', args[1:3])), 16)
+            validateNumArgs(token, 2)
+            setAddress, value = validateArgs(token, [machine.addressRange, range(0, 256)])
 
             # Perform a simple check to make sure the 'set' directive is not overwritting program data
             if setAddress in range(0, programEndAddress+1):
-                printErr("[ERROR] Set directive attempting to overwrite program memroy!")
-                printErr("\tAttempted wrtie address: " + str(setAddress))
-                printErr("\tProgram memory address range: " + str(range(0,programEndAddress+1)) + "\n")
-                printErr("\tAborting assembly process....\n")
-                exit()
+                raise AssemblyError("[ERROR] Set directive attempting to overwrite program memroy!\n" +
+                                     "\tAttempted wrtie address: " + str(setAddress) + "\n" +
+                                     "\tProgram memory address range: " + str(range(0,programEndAddress+1)) + "\n")
 
             # Finish 'set' directive
-            program[setAddress] = f'{value:02x}'
+            program[setAddress] = value
             return programEndAddress, program
 
         case _:
-            printErr("[ERROR] Instruction '" + mnemonic + "' is not valid!")
-            printErr("\tAborting assembly process....\n")
-            exit()
+            raise AssemblyError("[ERROR] Instruction '" + mnemonic + "' is not valid!")
     
-    # Update the program RAM and end address
-    programEndAddress = address
-    # program[address] = int(''.join(('0x', machineCode)), 16)
-    program[address] = machineCode
+    # Make sure the instruction fits in RAM
+    size = len(machineCode)
+    if address + size > machine.ramSize:
+        raise AssemblyError("[ERROR] Program does not fit in the " + str(machine.ramSize) + " bytes of RAM!\n" +
+                             "\tInstruction '" + str(token) + "' takes " + str(size) + " byte(s) starting at address " + str(address) + "\n")
+
+    # Update the program RAM and end address, most instructions are a single byte
+    programEndAddress = address + size - 1
+    if size == 1:
+        program[address] = machineCode[0]
+    else:
+        program[address:address + size] = machineCode
     return programEndAddress, program
 
 
+# Function for getting the values an instruction's operand can take
+# Operands are RAM addresses, except for ldi which keeps the original circuit's limit of half its operand's range
+def operandRange(mnemonic: str, machine: Machine = DEFAULT_MACHINE) -> range:
+    if mnemonic == 'ldi':
+        return range(0, 1 << (machine.operandBits - 1))
+    return machine.addressRange
+
+
 # This function generates machine code for an instruction
 # Instruction   -> nibble representing instruction
-# line          -> line of assembly containgin mnemonic and its arguments
+# token         -> tokenized line of assembly containing mnemonic and its arguments
 # numArgs       -> number of arguments instruction has
 # ragnes        -> list of numeric ranges for each argument
-# Returns a byte as a string in hex without '0x' that represents the machine code
-def generateMachineCode(instruction: int, line: str, numArgs: int = 0, ranges: typing.List[typing.Iterable[int]] = range(0,1)) -> str:
-    machineCode = f'{instruction:01x}'
-    validateNumArgs(line, numArgs)
+# machine       -> machine the instruction is laid out for
+# Returns the bytes of machine code for the instruction, one byte unless the machine gives the operand a byte of its own
+def generateMachineCode(instruction: int, token: Token, numArgs: int = 0, ranges: typing.List[typing.Iterable[int]] = range(0,1), machine: Machine = DEFAULT_MACHINE) -> bytes:
+    validateNumArgs(token, numArgs)
     if numArgs > 0:
-        machineCode += validateArgs(line, ranges)
-        return machineCode
+        return machine.encode(instruction, validateArgs(token, ranges)[0])
 
     # We are here if instruction doesn't contain arguments so pad it before returning
-    return machineCode + f'{0:01x}'
+    return machine.encode(instruction)
 
 
 # Function for validating type of argument
 # In this instruction set all arguments have to be integers
 # so we will only validate that the integers are in the correct range
 # and that the argument is indeed an integer
-# Returns all arguments concatenated from left to right as bytes in hex without '0x' in string format
-def validateArgs(line: str, ranges: typing.List[typing.Iterable[int]]) -> str:
-    args = line.split(None, 1)[1]
-    args = args.split()
+# Returns all arguments from left to right as integers
+def validateArgs(token: Token, ranges: typing.List[typing.Iterable[int]]) -> typing.List[int]:
+    args = list(token.args)
     numArgs = len(args)
 
     # Validate that instructions where programmed properly by checinig arg length against list of ranges
     if numArgs != len(ranges):
-        printErr("[ERROR] Instruction '" + line.split(None, 1)[0] + "' was not programmatically setup correctly!\n")
-        printErr("\tGo back to the program and make sure that the list of ranges matches the expected number of")
-        printErr("\tinstruction arguments.\n")
-        printErr("\tNumber of arguments: " + str(numArgs))
-        printErr("\tNumber of ranges: " + str(len(ranges)) + "\n")
-        printErr("\tAborting assembly process....\n")
-        exit()
+        raise AssemblyError("[ERROR] Instruction '" + token.mnemonic + "' was not programmatically setup correctly!\n\n" +
+                             "\tGo back to the program and make sure that the list of ranges matches the expected number of\n" +
+                             "\tinstruction arguments.\n\n" +
+                             "\tNumber of arguments: " + str(numArgs) + "\n" +
+                             "\tNumber of ranges: " + str(len(ranges)) + "\n")
     
     # Make sure all arguments are valid numbers
     for i, arg in enumerate(args):
         try:
             args[i] = int(arg, 16)
         except ValueError:
-            printErr("[ERROR] The argument '" + str(arg) + "' is not a valid integer!\n")
-            printErr("\tFor the line: " + line)
-            printErr("\tAborting assembly process....\n")
-            exit()
+            raise AssemblyError("[ERROR] The argument '" + str(arg) + "' is not a valid integer!\n\n" +
+                                 "\tFor the line: " + str(token))
         
         # Make sure hex representation is correct if user tried to write it without '0x'
         if '0x' not in arg:
-            printErr("[ERROR] The argument '" + str(arg) + "' is not a valid hex representation!\n")
-            printErr("\tFor the line: " + line)
-            printErr("\tAborting assembly process....\n")
-            exit()
+            raise AssemblyError("[ERROR] The argument '" + str(arg) + "' is not a valid hex representation!\n\n" +
+                                 "\tFor the line: " + str(token))
     
-    # Place to save arguments to and return
-    convertedArgs = ''
     # Validate argument range
     for i, numRange in enumerate(ranges):
         # The argument must be within its range to be valid
-        if int(args[i]) in numRange:
-            convertedArgs += f'{args[i]:01x}'
+        if args[i] in numRange:
             continue
 
         # Argument not incorrect range
-        printErr("[ERROR] The argument '" + str(args[i]) + "' is not within the " + str(numRange) + "!\n")
-        printErr("\tFor the line: " + line + "\n")
-        printErr("\tAborting assembly process....\n")
-        exit()
+        raise AssemblyError("[ERROR] The argument '" + str(args[i]) + "' is not within the " + str(numRange) + "!\n\n" +
+                             "\tFor the line: " + str(token) + "\n")
 
     # Done Converting
-    return convertedArgs
+    return args
 
 
 # Function for getting number of arguments passed to an instruction
-def validateNumArgs(line: str, numArgs: int):
-    mnemonic = line.split(None, 1)[0]
-
-    # Check if instruction has arguments
-    try:
-        args = line.split(None, 1)[1]
-    except IndexError:
-        # Intsruction doesn't have arguments and that's correct
-        if numArgs == 0:
-            return
-        
-        # Instruction doesn't have arguments but should have multiple...
-        printErr("[ERROR] Instruction '" + mnemonic + "' should have " + str(numArgs) + " argument/s!")
-        printErr("\tLine: " + line)
-        printErr("\tAborting assembly process....\n")
-        exit()
+def validateNumArgs(token: Token, numArgs: int):
+    # Intsruction doesn't have arguments and that's correct
+    if len(token.args) == numArgs:
+        return
+
+    # Instruction doesn't have arguments but should have multiple...
+    if len(token.args) == 0:
+        raise AssemblyError("[ERROR] Instruction '" + token.mnemonic + "' should have " + str(numArgs) + " argument/s!\n" +
+                             "\tLine: " + str(token))
     
     # Instruction has more arguments than it should have, or not enough in some cases
-    if len(args.split(None, 1)) != numArgs:
-        printErr("[ERROR] Instruction '" + mnemonic + "' should only have " + str(numArgs) + " arguments/!")
-        printErr("\tLine: " + line)
-        printErr("\tAborting assembly process....\n")
-        exit()
-    
-    # Instruction has correct amount of args if here
-    return
+    raise AssemblyError("[ERROR] Instruction '" + token.mnemonic + "' should only have " + str(numArgs) + " arguments/!\n" +
+                         "\tLine: " + str(token))
 
 
 # Function for linking labels to where they are referrenced
-def labelLink(intermediateFile: os.path):
-    # Method of resolving links
-    #   Find first label definition
-    #   Pop definition from file
-    #   Get address for that label
-    #   Find all references to that label and replace with address
-    #   Repeat for remaining labels
-
-    # Read all lines of files and store in array for easy modification
-    lines = readFile(intermediateFile)
-
-    # Get number of labels and run label error detection
-    numLabels = 0
-    labels = []
-    for line in lines:
-        if ':' in line:
-            numLabels += 1
-            labels.append(line.split(':')[0])
-
-            # Check if multiple labels on same line error exists
-            if len(line.split(':')) != 2:
-                printErr("[ERROR] Multi label definition found on single line!")
-                printErr("\t" + line)
-                printErr("\tAborting assembly process....\n")
-                exit()
-            
-            # Check that nothing comes after ':'
-            if not line.split(':')[1].isspace():
-                printErr("[ERROR] Unknown text found aftet label!")
-                printErr("\t" + line)
-                printErr("\tAborting assembly process....\n")
-                exit()
-            
-            # Check that nothing is before label
-            if len(line.split()) != 1:
-                printErr("[ERROR] Multiple symbols found before label!")
-                printErr("\t" + line)
-                printErr("\tAborting assembly process....\n")
-                exit()
-            
-            # Check that label is defined
-            if line.split(':')[0] == '':
-                printErr("[ERROR] Label not defined!")
-                printErr("\t" + line)
-                printErr("\tAborting assembly process....\n")
-                exit()
-            
-            # Make sure label is only defined once
-            if len(labels) != len(set(labels)):
-                printErr("[ERROR] Duplicate label defined!")
-                printErr("\t" + line)
-                printErr("\tAborting assembly process....\n")
-                exit()
-
-    # Perform label linking
-    for label in labels:
-        # Get address label refrences and remove it from program
-        labelAddress = lines.index(label + ":\n")
-        lines.pop(labelAddress)
-
-        # Resolve refrences to label
-        for i in range(len(lines)):
-            if label in lines[i]:
-                lines[i] = lines[i].replace(label, hex(labelAddress))
-
-    # Wrtie results to intermeddiate file
-    writeFile(intermediateFile, lines)
-
-
-# Method for striping anything unecessary from input file and converting it to standard format
-def stripFile(intermediateFile: os.path):
-    # Read all lines of files and store in array for easy modification
-    lines = lines = readFile(intermediateFile)
-
-    # Strip Comments
-    for i, _ in enumerate(lines):
-        if ';' in lines[i]:
-            lines[i] = lines[i].split(';', 1)[0]
-    
-    # Strip empty lines
-    tempLines = []
-    lines = list(filter(None, lines))
-    for i, line in enumerate(lines):
-        if line.isspace():
+# Returns the token stream with label definitions removed and all label references resolved to addresses
+def labelLink(tokens: typing.List[Token], machine: Machine = DEFAULT_MACHINE) -> typing.List[Token]:
+    return resolveLabels(tokens, machine)[0]
+
+
+# Function for resolving labels, the work behind labelLink
+# Returns the linked token stream along with the symbol table of label addresses
+def resolveLabels(tokens: typing.List[Token], machine: Machine = DEFAULT_MACHINE) -> typing.Tuple[typing.List[Token], typing.Dict[str, int]]:
+    # Method of resolving links (two pass)
+    #   Pass one: record the address of every label definition in a symbol table and drop the definition
+    #   Pass two: resolve every operand that names a label (or label arithmetic) through the symbol table
+    # As every label is known before any operand is resolved, forward references work as expected
+    program, symbols = defineLabels(tokens, machine)
+
+    # Pass two, resolve refrences to labels
+    for token in program:
+        token.args = [resolveOperand(arg, symbols, token) for arg in token.args]
+
+    return program, symbols
+
+
+# Function for the first pass of resolving labels, building the symbol table and running label error detection
+# Returns the token stream with label definitions removed along with the address of every label
+def defineLabels(tokens: typing.List[Token], machine: Machine = DEFAULT_MACHINE) -> typing.Tuple[typing.List[Token], typing.Dict[str, int]]:
+    symbols: typing.Dict[str, int] = {}
+    program: typing.List[Token] = []
+    address = 0
+    operandSize = machine.operandSize
+    for token in tokens:
+        line = str(token)
+        if ':' not in line:
+            program.append(token)
+            # Same as machine.instructionSize, without a call for every token
+            if token.mnemonic != 'set':
+                address += 1 + operandSize if token.args else 1
             continue
 
-        tempLine = ''
-        for part in line.split():
-            tempLine += part + ' '
-        tempLine = tempLine.strip() + '\n'
-        tempLines.append(tempLine)
-    lines = tempLines
+        # Check if multiple labels on same line error exists
+        if len(line.split(':')) != 2:
+            raise AssemblyError("[ERROR] Multi label definition found on single line!\n" +
+                                 "\t" + line, token.lineNumber)
+        
+        # Check that nothing comes after ':'
+        if line.split(':')[1] != '':
+            raise AssemblyError("[ERROR] Unknown text found aftet label!\n" +
+                                 "\t" + line, token.lineNumber)
+        
+        # Check that nothing is before label
+        if len(token.args) != 0:
+            raise AssemblyError("[ERROR] Multiple symbols found before label!\n" +
+                                 "\t" + line, token.lineNumber)
+        
+        # Check that label is defined
+        label = line.split(':')[0]
+        if label == '':
+            raise AssemblyError("[ERROR] Label not defined!\n" +
+                                 "\t" + line, token.lineNumber)
+        
+        # Make sure label is only defined once
+        if label in symbols:
+            raise AssemblyError("[ERROR] Duplicate label defined!\n" +
+                                 "\t" + line, token.lineNumber)
+
+        # A label points at the next instruction in the program
+        symbols[label] = address
+
+    return program, symbols
+
+
+# Function for resolving a single operand against the symbol table
+# Operands can be a number, a label, or label arithmetic such as 'loop+1' or 'data-0x2'
+# Returns the operand in hex representation if it referenced a label, otherwise the operand untouched
+def resolveOperand(arg: str, symbols: typing.Dict[str, int], token: Token) -> str:
+    # Fast path, a plain label
+    if arg in symbols:
+        return hex(symbols[arg])
+
+    # Fast path, a plain number is handled by argument validation
+    terms = re.split(r'([+-])', arg)
+    if len(terms) == 1 and not isLabelName(arg):
+        return arg
+
+    # Evaluate the label arithmetic from left to right
+    value = 0
+    sign = 1
+    for i, term in enumerate(terms):
+        # A leading sign leaves an empty first term, e.g. '-1'
+        if i == 0 and term == '':
+            continue
+
+        if term == '+' or term == '-':
+            sign = 1 if term == '+' else -1
+            continue
+
+        if term in symbols:
+            value += sign * symbols[term]
+        elif isLabelName(term):
+            raise AssemblyError("[ERROR] Label '" + term + "' is not defined!\n" +
+                                 "\tLine " + str(token.lineNumber) + ": " + str(token), token.lineNumber)
+        else:
+            try:
+                value += sign * int(term, 0)
+            except ValueError:
+                raise AssemblyError("[ERROR] The term '" + term + "' in '" + arg + "' is not a valid integer!\n\n" +
+                                     "\tLine " + str(token.lineNumber) + ": " + str(token), token.lineNumber)
+
+    return hex(value)
+
+
+# Function for checking if a symbol could be a label name rather than a number
+def isLabelName(symbol: str) -> bool:
+    return symbol != '' and (symbol[0].isalpha() or symbol[0] == '_')
 
-    # Set all characters to lowercase
-    for i in range(len(lines)):
-        lines[i] = lines[i].lower()
 
-    # Move all set directives to end of file and remove the ',' from them
+# Method for striping anything unecessary from the source and tokenizing it into a standard format
+# Each line is split exactly once, every later stage works on the resulting token stream
+def stripFile(source: str) -> typing.List[Token]:
+    tokens = []
     directives = []
-    for i in range(len(lines)-1, -1, -1):
-        if lines[i].split()[0] == 'set':
-            directives.append(lines[i])
-            lines.pop(i)
-    
-    for i in range(len(directives)):
-        lines.append(directives[i].replace(',', ' '))
-
-    # Set all decimal numbers to hex representation
-    for i in range(len(lines)):
-        tokens = []
-        for token in lines[i].split():
-            if token.isnumeric():
-                tokens.append(hex(int(token)))
-                continue
-            tokens.append(token)
-        
-        tempLine = ''
-        for token in tokens:
-            tempLine += token + ' '
-        lines[i] = tempLine.strip() + '\n'
-    
-    # Wrtie the parsed intermeddiate file
-    writeFile(intermediateFile, lines)
+
+    for lineNumber, line in enumerate(source.splitlines(), 1):
+        # Strip comments
+        line = line.split(';', 1)[0]
+
+        # Set all characters to lowercase and remove the ',' from set directives
+        line = line.lower()
+        if line.split(None, 1)[:1] == ['set']:
+            line = line.replace(',', ' ')
+
+        # Strip empty lines
+        parts = line.split()
+        if not parts:
+            continue
+
+        # Set all decimal numbers to hex representation
+        parts = [hex(int(part)) if part.isdecimal() else part for part in parts]
+        token = Token(parts[0], parts[1:], lineNumber)
+
+        # Move all set directives to end of the token stream
+        if token.mnemonic == 'set':
+            directives.append(token)
+            continue
+        tokens.append(token)
+
+    tokens.extend(reversed(directives))
+    return tokens
 
 
 # Argument Parsing
-def argParse() -> typing.Tuple[FileProps]:
+def argParse() -> argparse.Namespace:
     # Instantiate the parser and parse arguments
     parser = argparse.ArgumentParser(description='The SAP-1 Assembler!')
-    parser.add_argument('input_file', type=str, help="The file to assemble")
-    parser.add_argument('output_file', type=str, nargs='?', default="out.bin", help="Output file path and name. Default -> out.bin")
+    parser.add_argument('input_file', type=str, nargs='?', help="The file to assemble, '-' reads the source from stdin")
+    parser.add_argument('output_file', type=str, nargs='?', default="out.bin", help="Output file path and name, '-' writes the image to stdout. Default -> out.bin")
+    parser.add_argument('-O', '--optimize', action='store_true', help="Run the peephole optimizer on the program and report what it saved")
+    parser.add_argument('-t', '--timing', action='store_true', help="Print the T-states of every line, basic block, loop and path to 'hlt'")
+    parser.add_argument('--rom', type=str, default=DEFAULT_ROM, help="Microcode ROM the cycle counts are read from. Default -> microcode-rom")
+    parser.add_argument('--clock', type=float, default=None, help="Clock rate in Hz, adds run times to the timing report")
+    parser.add_argument('-f', '--format', choices=list(IMAGE_EXTENSIONS), default='logisim', help="Image format, Logisim hex, raw bytes or Intel HEX. Default -> logisim")
+    parser.add_argument('-c', '--object', action='store_true', help="Write a relocatable object file for link.py instead of an image")
+    parser.add_argument('-m', '--machine', type=str, default=DEFAULT_MACHINE.name, help="Machine to assemble for, sap1, sap1-256 or a machine description JSON file. Default -> sap1")
+    parser.add_argument('--archive', type=str, default=None, help="In batch mode, also pack every image into one raw archive file")
+    parser.add_argument('-b', '--batch', type=str, nargs='+', metavar='INPUT', help="Assemble many files, directories or glob patterns (e.g. 'examples/*.sap') in parallel")
+    parser.add_argument('-w', '--watch', type=str, metavar='DIR', help="Keep running and re-assemble the '.sap' files in a directory whenever they change")
+    parser.add_argument('-o', '--out-dir', type=str, help="Output directory for batch and watch mode. Default -> next to each input")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes for batch mode. Default -> number of CPUs")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Image cache for watch mode. Default -> .sapcache in the watched directory")
+    parser.add_argument('--interval', type=float, default=0.5, help="Seconds between checks for changes in watch mode. Default -> 0.5")
+    parser.add_argument('--serve', type=str, metavar='ADDRESS', help="Run as a server on a Unix socket path or '[host:]port' on TCP, answering JSON requests")
+    parser.add_argument('--framed', action='store_true', help="Assemble many sources sent down stdin as length prefixed frames, answering each one on stdout")
     args = parser.parse_args()
 
-    inputFullPath = os.path.abspath(args.input_file)
-    outputFullPath = os.path.abspath(args.output_file)
+    try:
+        args.machine = Load_Machine(args.machine)
+    except ValueError as err:
+        parser.error(str(err))
+
+    # Batch, watch, server and framed mode work from their own list of inputs
+    if args.batch is not None or args.watch is not None or args.serve is not None or args.framed:
+        return args
+
+    if args.input_file is None:
+        parser.error("an input file is required unless --batch, --watch, --serve or --framed is used")
+
+    # '-' streams through stdin/stdout instead of a file
+    args.inputFile = None
+    if args.input_file != '-':
+        inputFullPath = os.path.abspath(args.input_file)
+        args.inputFile = FileProps(os.path.basename(inputFullPath), os.path.dirname(inputFullPath), inputFullPath)
+
+    args.outputFile = None
+    if args.output_file != '-':
+        outputFullPath = os.path.abspath(args.output_file)
 
-    # Check for extension, if none, add '.bin'
-    if pathlib.Path(outputFullPath).suffix == '':
-        outputFullPath += '.bin'
+        # Check for extension, if none, add '.bin' ('.obj' for object files)
+        if pathlib.Path(outputFullPath).suffix == '':
+            outputFullPath += '.obj' if args.object else '.bin'
 
-    inputFile = FileProps(os.path.basename(inputFullPath), os.path.dirname(inputFullPath), inputFullPath)
-    outputFile = FileProps(os.path.basename(outputFullPath), os.path.dirname(outputFullPath), outputFullPath)
+        args.outputFile = FileProps(os.path.basename(outputFullPath), os.path.dirname(outputFullPath), outputFullPath)
     
-    return (inputFile, outputFile)
+    return args
 
 
-# Function for reading a file and returning each line as a section of an array
-def readFile(filePath: os.path) -> typing.List[str]:
-    # Read all lines of files and store in array for easy modification
+# Function for reading a file and returning its contents
+def readFile(filePath: os.path) -> str:
     file = open(filePath, 'r')
+    contents = file.read()
+    file.close()
+    return contents
 
-    lines = []
-    for line in file:
-        lines.append(line)
 
+# Function for writing text to a file
+def writeFile(filePath: os.path, contents: str):
+    file = open(filePath, 'w')
+    file.write(contents)
     file.close()
-    return lines
 
 
-# Function for writing lines to a file
-def writeFile(filePath: os.path, lines: typing.List[str]):
-    # Wrtie the parsed intermeddiate file
-    file = open(filePath, 'w')
-    file.writelines(lines)
+# Function for reading a file as raw bytes
+def readBinaryFile(filePath: os.path) -> bytes:
+    file = open(filePath, 'rb')
+    contents = file.read()
     file.close()
+    return contents
+
+
+# Function for writing raw bytes to a file
+def writeBinaryFile(filePath: os.path, contents: bytes):
+    file = open(filePath, 'wb')
+    file.write(contents)
+    file.close()
+
+
+# Function for writing a file only if it would change, so tools watching the file don't see needless writes
+def writeFileIfChanged(filePath: os.path, contents: bytes):
+    if os.path.exists(filePath) and readBinaryFile(filePath) == contents:
+        return
+
+    writeBinaryFile(filePath, contents)
 
 
 # Easy error printing
@@ -0,0 +1,191 @@
+import argparse
+import os
+import pathlib
+import sys
+import typing
+
+import assemble
+from assemble import AssemblyError, Machine, ObjectModule
+
+
+class Linker:
+    """Class for placing object modules in RAM and resolving the labels they refer to"""
+
+    def __init__(self, modules: typing.List[ObjectModule], machine: Machine = assemble.DEFAULT_MACHINE):
+        self.modules = modules
+        self.machine = machine
+
+        # Modules are placed back to back in the order given, the first one at address 0 where the program starts
+        self.bases: typing.List[int] = []
+        address = 0
+        for module in modules:
+            if module.machine != machine:
+                raise AssemblyError("[ERROR] Module '" + module.name + "' was assembled for the machine '" + module.machine.name + "', not '" + machine.name + "'!")
+            self.bases.append(address)
+            address += len(module.code)
+        self.codeEnd = address
+
+        if self.codeEnd > machine.ramSize:
+            raise AssemblyError("[ERROR] Linked program does not fit in the " + str(machine.ramSize) + " bytes of RAM!\n" +
+                                 "\tThe modules take up " + str(self.codeEnd) + " bytes: " +
+                                 ', '.join(module.name + " (" + str(len(module.code)) + ")" for module in modules) + "\n")
+
+        # Where every label of every module ended up, a label defined by two modules is only an error once a third one uses it
+        self.exports: typing.Dict[str, typing.List[typing.Tuple[int, int]]] = {}
+        for index, module in enumerate(modules):
+            for label, offset in module.symbols.items():
+                self.exports.setdefault(label, []).append((index, self.bases[index] + offset))
+
+    # Build the RAM image, code first and then the 'set' directives which may not write over any module's code
+    def link(self) -> bytes:
+        image = bytearray(self.machine.ramSize)
+
+        for index, module in enumerate(self.modules):
+            base = self.bases[index]
+            image[base:base + len(module.code)] = module.code
+
+            # The operand was assembled as 0, so the value goes straight into its bits
+            for relocation in module.relocations:
+                value = self.resolve(index, relocation.symbol, relocation.lineNumber) + relocation.addend
+                self.checkRange(index, value, range(0, relocation.limit), relocation.lineNumber)
+                image[base + relocation.offset] |= value
+
+        for index, module in enumerate(self.modules):
+            for directive in module.directives:
+                setAddress = self.resolveReference(index, directive.address, directive.lineNumber)
+                value = self.resolveReference(index, directive.value, directive.lineNumber)
+                self.checkRange(index, setAddress, range(0, self.machine.ramSize), directive.lineNumber)
+                self.checkRange(index, value, range(0, 256), directive.lineNumber)
+
+                if setAddress < self.codeEnd:
+                    raise AssemblyError("[ERROR] Set directive in module '" + module.name + "' attempting to overwrite program memory!\n" +
+                                         "\tAttempted write address: " + str(setAddress) + "\n" +
+                                         "\tProgram memory address range: " + str(range(0, self.codeEnd)) + "\n", directive.lineNumber)
+                image[setAddress] = value
+
+        return bytes(image)
+
+    # Get the address of a label as seen from a module, its own labels come first
+    def resolve(self, index: int, symbol: str, lineNumber: int) -> int:
+        module = self.modules[index]
+        if symbol in module.symbols:
+            return self.bases[index] + module.symbols[symbol]
+
+        definitions = self.exports.get(symbol, [])
+        if not definitions:
+            raise AssemblyError("[ERROR] Label '" + symbol + "' used in module '" + module.name + "' is not defined in any module!\n" +
+                                 "\tLine " + str(lineNumber) + "\n", lineNumber)
+        if len(definitions) > 1:
+            raise AssemblyError("[ERROR] Label '" + symbol + "' used in module '" + module.name + "' is defined in more than one module: " +
+                                 ', '.join(self.modules[other].name for other, _ in definitions) + "\n" +
+                                 "\tLine " + str(lineNumber) + "\n", lineNumber)
+        return definitions[0][1]
+
+    # Get the value of a 'set' directive's address or value, (None, number) is just the number
+    def resolveReference(self, index: int, reference: typing.Tuple[str, int], lineNumber: int) -> int:
+        symbol, addend = reference
+        return addend if symbol is None else self.resolve(index, symbol, lineNumber) + addend
+
+    def checkRange(self, index: int, value: int, valueRange: range, lineNumber: int):
+        if value not in valueRange:
+            raise AssemblyError("[ERROR] The value '" + str(value) + "' in module '" + self.modules[index].name + "' is not within the " + str(valueRange) + "!\n" +
+                                 "\tLine " + str(lineNumber) + "\n", lineNumber)
+
+
+# Function for linking object modules into one RAM image
+def linkModules(modules: typing.List[ObjectModule], machine: Machine = assemble.DEFAULT_MACHINE) -> bytes:
+    return Linker(modules, machine).link()
+
+
+# Function for getting the object module of a source, it is only assembled again when something changed
+# The object file is kept next to the source (or in objectDir) and reused as long as its key still matches the source, assembler and machine
+# Returns the module and whether it had to be assembled
+def buildObject(sourceFile: str, objectDir: str = None, machine: Machine = assemble.DEFAULT_MACHINE) -> typing.Tuple[ObjectModule, bool]:
+    source = assemble.readFile(sourceFile)
+    name = pathlib.Path(sourceFile).stem
+    objectFile = os.path.join(objectDir or os.path.dirname(os.path.abspath(sourceFile)), name + '.obj')
+
+    if os.path.exists(objectFile):
+        try:
+            module = assemble.parseObject(assemble.readFile(objectFile))
+            if module.key == assemble.objectKey(source, machine):
+                return module, False
+        except AssemblyError:
+            # A damaged object file is simply built again
+            pass
+
+    module = assemble.assembleObject(source, name, machine)
+    assemble.writeFileIfChanged(objectFile, assemble.formatObject(module).encode())
+    return module, True
+
+
+# Function for loading one linker input, '.sap' sources go through buildObject and anything else is read as an object file
+def loadModule(inputFile: str, objectDir: str = None, machine: Machine = assemble.DEFAULT_MACHINE) -> typing.Tuple[ObjectModule, bool]:
+    if pathlib.Path(inputFile).suffix == '.sap':
+        return buildObject(inputFile, objectDir, machine)
+    return assemble.parseObject(assemble.readFile(inputFile)), False
+
+
+def main():
+    args = argParse()
+
+    # Status goes to stderr when stdout carries the image
+    log = sys.stderr if args.output == '-' else sys.stdout
+
+    if args.obj_dir is not None:
+        os.makedirs(args.obj_dir, exist_ok=True)
+
+    modules = []
+    for inputFile in args.inputs:
+        try:
+            module, assembled = loadModule(inputFile, args.obj_dir, args.machine)
+        except (AssemblyError, OSError) as err:
+            printErr("[FAIL] " + inputFile)
+            printErr("\t" + str(err).replace("\n", "\n\t"))
+            printErr("\tAborting link process....\n")
+            sys.exit(1)
+
+        print(("[ASM]  " if assembled else "[OBJ]  ") + inputFile, file=log)
+        modules.append((module, assembled))
+
+    try:
+        image = linkModules([module for module, _ in modules], args.machine)
+    except AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting link process....\n")
+        sys.exit(1)
+
+    if args.output == '-':
+        sys.stdout.buffer.write(assemble.encodeImage(image, args.format))
+        sys.stdout.flush()
+    else:
+        assemble.writeBinaryFile(args.output, assemble.encodeImage(image, args.format))
+
+    print("\nLinked " + str(len(modules)) + " modules, " + str(sum(assembled for _, assembled in modules)) + " assembled and " +
+          str(sum(not assembled for _, assembled in modules)) + " reused: " + args.output + "\n", file=log)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='The SAP-1 linker, links object files and sources into one RAM image')
+    parser.add_argument('inputs', type=str, nargs='+', help="Object files (assemble.py -c) or '.sap' sources, placed in RAM in this order from address 0")
+    parser.add_argument('-o', '--output', type=str, default="out.bin", help="Output image, '-' writes it to stdout. Default -> out.bin")
+    parser.add_argument('--obj-dir', type=str, default=None, help="Where the objects of '.sap' sources are kept. Default -> next to each source")
+    parser.add_argument('-f', '--format', choices=list(assemble.IMAGE_EXTENSIONS), default='logisim', help="Image format, Logisim hex, raw bytes or Intel HEX. Default -> logisim")
+    parser.add_argument('-m', '--machine', type=str, default=assemble.DEFAULT_MACHINE.name, help="Machine to link for, sap1, sap1-256 or a machine description JSON file. Default -> sap1")
+    args = parser.parse_args()
+
+    try:
+        args.machine = assemble.Load_Machine(args.machine)
+    except ValueError as err:
+        parser.error(str(err))
+    return args
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
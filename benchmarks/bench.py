@@ -0,0 +1,233 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import typing
+
+# The benchmarks drive the tools straight from their folders, the same way they are run by hand
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "emulator"))
+
+import emulate
+
+assemble = emulate.loadAssembler()
+generator = emulate.loadGenerator()
+
+# Synthetic source sizes in lines, from a program that fits in RAM up to a file far larger than anything hand written
+SIZES = {
+    "tiny": 16,
+    "small": 1_000,
+    "large": 100_000,
+}
+
+
+# Function for building a label heavy synthetic source of roughly the given number of lines
+# Every block defines a label and references labels before and after it, so the linker has real work to do
+# The result only has to make it through stripFile and labelLink, it is far too big to fit in RAM
+def syntheticSource(lines: int) -> str:
+    blocks = max(1, lines // 8)
+    source = ["; Synthetic benchmark source", "set 0xf, 1", ""]
+    for block in range(blocks):
+        source += [
+            "block_" + str(block) + ":",
+            "\tlda block_" + str(max(block - 1, 0)) + "+1\t; previous block",
+            "\tadd 0xf",
+            "\tsta data_" + str(block % 4),
+            "\tjz block_" + str((block + 1) % blocks),
+            "\tout",
+            "\tjmp block_" + str(block // 2),
+            "",
+        ]
+
+    for data in range(4):
+        source += ["data_" + str(data) + ":", "\tnop"]
+    return "\n".join(source) + "\n"
+
+
+# Function for timing a benchmark the way timeit does, the best of several runs of a calibrated number of calls
+# When setup is given every call gets its own fresh argument, built before the clock starts
+# Returns the seconds taken by a single call
+def measure(function: typing.Callable, setup: typing.Callable = None, repeat: int = 5, minTime: float = 0.2) -> float:
+    number = 1
+    while True:
+        seconds = timeCalls(function, setup, number)
+        if seconds >= minTime:
+            break
+        number *= 10 if seconds < minTime / 10 else 2
+
+    best = seconds
+    for _ in range(repeat - 1):
+        best = min(best, timeCalls(function, setup, number))
+    return best / number
+
+
+# Garbage collection is switched off while the clock runs, like timeit, so a collection doesn't land on a random benchmark
+def timeCalls(function: typing.Callable, setup: typing.Callable, number: int) -> float:
+    arguments = [setup() for _ in range(number)] if setup is not None else None
+
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        if arguments is None:
+            for _ in range(number):
+                function()
+        else:
+            for argument in arguments:
+                function(argument)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+# Function for copying a token stream, labelLink resolves arguments in place so every run needs its own copy
+def copyTokens(tokens: typing.List[assemble.Token]) -> typing.List[assemble.Token]:
+    return [assemble.Token(token.mnemonic, list(token.args), token.lineNumber) for token in tokens]
+
+
+# Benchmarks of each assembler stage on every synthetic size
+def benchAssembler(results: dict, minTime: float):
+    for name, lines in SIZES.items():
+        source = syntheticSource(lines)
+        tokens = assemble.stripFile(source)
+
+        results["assembler.stripFile." + name] = {"seconds": measure(lambda: assemble.stripFile(source), minTime=minTime), "lines": lines}
+        results["assembler.labelLink." + name] = {"seconds": measure(assemble.labelLink, lambda: copyTokens(tokens), minTime=minTime), "lines": lines}
+
+    # convertInstruction has to produce real machine code, so it runs over every instruction of the example programs
+    programs = [assemble.labelLink(assemble.stripFile(assemble.readFile(path))) for path in examplePrograms()]
+    tokens = [token for program in programs for token in program]
+
+    def convertAll():
+        for program in programs:
+            image = bytearray(16)
+            end = 0
+            for address, token in enumerate(program):
+                end, image = assemble.convertInstruction(token, address, end, image)
+
+    seconds = measure(convertAll, minTime=minTime)
+    results["assembler.convertInstruction"] = {"seconds": seconds / len(tokens), "instructions": len(tokens)}
+    results["assembler.assembleSource.examples"] = {"seconds": measure(lambda: [assemble.assembleSource(assemble.readFile(path)) for path in examplePrograms()], minTime=minTime)}
+
+
+# Benchmark of generating the microcode ROM
+def benchGenerator(results: dict, minTime: float):
+    results["generator.Gen_Rom"] = {"seconds": measure(generator.Gen_Rom, minTime=minTime)}
+    rom = generator.Gen_Rom()
+    results["generator.Hash_Rom"] = {"seconds": measure(lambda: generator.Hash_Rom(rom), minTime=minTime)}
+
+
+# Benchmarks of the emulator running every example program to completion, on the microcode and in fast mode
+def benchEmulator(results: dict, minTime: float):
+    rom = emulate.loadRom()
+    for path in examplePrograms():
+        name = os.path.splitext(os.path.basename(path))[0]
+        image = emulate.loadImage(path)
+
+        for mode, compiled in (("microcode", False), ("fast", True)):
+            machine = emulate.SAP1(rom, image, compiled)
+
+            def runProgram():
+                machine.reset()
+                machine.run(10_000_000)
+
+            seconds = measure(runProgram, minTime=minTime)
+            results["emulator." + mode + "." + name] = {"seconds": seconds, "instructions": machine.instructions, "instructionsPerSecond": machine.instructions / seconds}
+
+
+def examplePrograms() -> typing.List[str]:
+    return sorted(glob.glob(os.path.join(ROOT_DIR, "examples", "*.sap")))
+
+
+SUITES = {
+    "assembler": benchAssembler,
+    "generator": benchGenerator,
+    "emulator": benchEmulator,
+}
+
+
+# Function for comparing results against a baseline, only the time per call is compared
+# Returns the names of the benchmarks that got slower by more than the threshold
+def compareResults(results: dict, baseline: dict, threshold: float) -> typing.List[str]:
+    regressions = []
+    print(f'{"benchmark":42s} {"baseline":>12s} {"current":>12s} {"change":>8s}')
+    for name, result in results.items():
+        if name not in baseline:
+            print(f'{name:42s} {"-":>12s} {formatSeconds(result["seconds"]):>12s} {"new":>8s}')
+            continue
+
+        change = result["seconds"] / baseline[name]["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f'{name:42s} {formatSeconds(baseline[name]["seconds"]):>12s} {formatSeconds(result["seconds"]):>12s} {change:+8.1%}' + flag)
+
+    return regressions
+
+
+def formatSeconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3f} {unit}'
+    return f'{seconds / 1e-9:.1f} ns'
+
+
+def main():
+    args = argParse()
+
+    results = {}
+    for suite in args.suites or SUITES:
+        SUITES[suite](results, args.min_time)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+    if args.output is not None:
+        assemble.writeFile(args.output, json.dumps(report, indent=2) + "\n")
+    if args.save_baseline is not None:
+        assemble.writeFile(args.save_baseline, json.dumps(report, indent=2) + "\n")
+        print("Baseline written to " + args.save_baseline)
+
+    # Timings only mean something next to a baseline recorded on the same host, so comparing is opt-in
+    if args.baseline is None:
+        for name, result in results.items():
+            print(f'{name:42s} {formatSeconds(result["seconds"]):>12s}')
+        return
+
+    try:
+        baseline = json.loads(assemble.readFile(args.baseline))["results"]
+    except (OSError, ValueError, KeyError) as err:
+        printErr("[ERROR] Can't read the baseline '" + args.baseline + "': " + str(err))
+        sys.exit(1)
+    regressions = compareResults(results, baseline, args.threshold)
+    if regressions:
+        printErr("[ERROR] " + str(len(regressions)) + " benchmark(s) regressed by more than " + f'{args.threshold:.0%}' + ": " + ', '.join(regressions))
+        sys.exit(1)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarks for the SAP-1 assembler, microcode generator and emulator')
+    parser.add_argument('-s', '--suite', dest='suites', action='append', choices=list(SUITES), help="Suite to run, can be given more than once. Default -> all of them")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', type=str, default=None, help="Baseline recorded on this host to compare against, the exit code is 1 on a regression. Default -> no comparison")
+    parser.add_argument('--save-baseline', type=str, default=None, help="Store these results as a baseline in this file")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Slowdown that counts as a regression. Default -> 0.25 (25%%)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds each timing run should last at least. Default -> 0.2")
+    return parser.parse_args()
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import os
+import pathlib
+import sys
+import xml.parsers.expat
+
+# The assembler reads programs and Logisim hex files for us
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "assembler"))
+import assemble
+
+
+# Define the components that get new contents, matched on their type and address width
+#   RAM -> the 16 byte program RAM in the main circuit
+#   ROM -> the 128 word microcode ROM in the control unit
+targets = {
+    "RAM": ("RAM", 4, 8),
+    "MICROCODE": ("ROM", 7, 24),
+}
+
+# Input files
+CIRCUIT = "./SAP1.circ"
+MICROCODE_ROM = "./microcode-rom"
+
+# Logisim writes this many words per line and runs of at least this many equal words as count*word
+WORDS_PER_LINE = 8
+MIN_RUN = 4
+
+
+# Inject every program into its own copy of the circuit
+def main():
+    args = argParse()
+
+    try:
+        template = Read_Template(args.circuit)
+        spans = Find_Contents(template)
+        rom = assemble.readRomWords(args.rom) if not args.keep_rom else None
+    except (OSError, ValueError, assemble.AssemblyError) as err:
+        print("ERROR: " + str(err), file=sys.stderr)
+        sys.exit(1)
+
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    failed = 0
+    for program in args.programs:
+        outputFile = os.path.join(args.out_dir or os.path.dirname(program), pathlib.Path(program).stem + ".circ")
+        try:
+            circuit = Inject(template, spans, Load_Image(program), rom)
+        except (OSError, ValueError, assemble.AssemblyError) as err:
+            print("[FAIL] " + program + "\n" + str(err), file=sys.stderr)
+            failed += 1
+            continue
+
+        file = open(outputFile, 'wb')
+        file.write(circuit)
+        file.close()
+        print("[OK]   " + program + " -> " + outputFile)
+
+    print("\n" + str(len(args.programs) - failed) + " of " + str(len(args.programs)) + " circuits written")
+    if failed:
+        sys.exit(1)
+
+
+# Read the circuit file as raw bytes, every offset the XML parser reports is a byte offset
+def Read_Template(filePath: str) -> bytes:
+    file = open(filePath, 'rb')
+    template = file.read()
+    file.close()
+    return template
+
+
+# Stream through the circuit's XML once and find where each target component's contents go
+# Returns the byte span to replace for every target, a component without contents gets an empty span right before its '</comp>'
+def Find_Contents(template: bytes) -> dict:
+    parser = xml.parsers.expat.ParserCreate()
+    spans = {}
+    component = None
+
+    def Start_Element(name: str, attributes: dict):
+        nonlocal component
+        if name == "comp":
+            component = {"type": attributes.get("name"), "attributes": {}, "contentsStart": None, "contents": None}
+        elif name == "a" and component is not None:
+            component["attributes"][attributes.get("name")] = attributes.get("val")
+            if attributes.get("name") == "contents":
+                component["contentsStart"] = parser.CurrentByteIndex
+
+    def End_Element(name: str):
+        nonlocal component
+        if name == "a" and component is not None and component["contentsStart"] is not None and component["contents"] is None:
+            component["contents"] = (component["contentsStart"], parser.CurrentByteIndex + len(b"</a>"))
+        elif name == "comp" and component is not None:
+            for target, (kind, addressBits, dataBits) in targets.items():
+                if Matches(component, kind, addressBits, dataBits):
+                    if target in spans:
+                        raise ValueError("The circuit has more than one component matching " + target)
+
+                    # Without contents the new attribute goes on its own line right before '</comp>'
+                    end = template.rindex(b"\n", 0, parser.CurrentByteIndex) + 1
+                    spans[target] = component["contents"] or (end, end)
+            component = None
+
+    parser.StartElementHandler = Start_Element
+    parser.EndElementHandler = End_Element
+    try:
+        parser.Parse(template, True)
+    except xml.parsers.expat.ExpatError as err:
+        raise ValueError("The circuit is not valid XML: " + str(err))
+
+    for target in targets:
+        if target not in spans:
+            raise ValueError("The circuit has no component matching " + target)
+    return spans
+
+
+# Check a component against a target, Logisim leaves out attributes that have their default value (8 bit data)
+def Matches(component: dict, kind: str, addressBits: int, dataBits: int) -> bool:
+    attributes = component["attributes"]
+    return (component["type"] == kind and attributes.get("addrWidth") == str(addressBits)
+            and attributes.get("dataWidth", "8") == str(dataBits))
+
+
+# Format words the way Logisim stores memory contents, trailing zeros are left out
+def Format_Contents(words: list, addressBits: int, dataBits: int) -> str:
+    words = list(words)
+    while words and words[-1] == 0:
+        words.pop()
+
+    parts = []
+    index = 0
+    while index < len(words):
+        run = 1
+        while index + run < len(words) and words[index + run] == words[index]:
+            run += 1
+
+        if run >= MIN_RUN:
+            parts.append(str(run) + "*" + f'{words[index]:x}')
+        else:
+            parts += [f'{words[index]:x}'] * run
+        index += run
+
+    lines = [' '.join(parts[start:start + WORDS_PER_LINE]) for start in range(0, len(parts), WORDS_PER_LINE)]
+    return "addr/data: " + str(addressBits) + " " + str(dataBits) + "\n" + ''.join(line + "\n" for line in lines)
+
+
+# Build one circuit, replacing the target spans from last to first so earlier offsets stay valid
+def Inject(template: bytes, spans: dict, image: bytes, rom: list = None) -> bytes:
+    contents = {"RAM": image}
+    if rom is not None:
+        contents["MICROCODE"] = rom
+
+    circuit = template
+    for target, (start, end) in sorted(spans.items(), key=lambda span: span[1][0], reverse=True):
+        if target not in contents:
+            continue
+
+        _, addressBits, dataBits = targets[target]
+        if len(contents[target]) > 1 << addressBits:
+            raise ValueError(target + " has " + str(len(contents[target])) + " words, the component only holds " + str(1 << addressBits))
+
+        attribute = '<a name="contents">' + Format_Contents(contents[target], addressBits, dataBits) + '</a>'
+        if start == end:
+            attribute = "      " + attribute + "\n"
+        circuit = circuit[:start] + attribute.encode() + circuit[end:]
+
+    return circuit
+
+
+# Load a program as a RAM image in any of the assembler's formats, '.sap' sources are assembled first
+def Load_Image(filePath: str) -> bytes:
+    if pathlib.Path(filePath).suffix == '.sap':
+        return assemble.assembleSource(assemble.readFile(filePath))
+    return assemble.readImage(filePath)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Write programs into copies of SAP1.circ, ready to run in Logisim')
+    parser.add_argument('programs', type=str, nargs='+', help="Assembled images or '.sap' sources, one circuit is written per program")
+    parser.add_argument('-o', '--out-dir', type=str, default=None, help="Output directory. Default -> next to each program")
+    parser.add_argument('--circuit', type=str, default=CIRCUIT, help="Circuit to copy. Default -> SAP1.circ")
+    parser.add_argument('--rom', type=str, default=MICROCODE_ROM, help="Microcode ROM written into the control unit. Default -> microcode-rom")
+    parser.add_argument('--keep-rom', action='store_true', help="Leave the circuit's microcode ROM as it is")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
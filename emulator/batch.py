@@ -0,0 +1,163 @@
+import argparse
+import sys
+import typing
+
+import numpy as np
+
+import emulate
+
+
+# Every machine in a batch is the 16 byte SAP-1 the circuit implements
+RAM_SIZE = 16
+
+
+class BatchSAP1:
+    """N SAP-1 machines held as NumPy arrays and advanced one instruction per step in lockstep"""
+
+    def __init__(self, images: typing.Union[np.ndarray, typing.List[bytes]], rom: typing.List[int] = None, maxOutputs: int = 256):
+        images = np.asarray([np.frombuffer(bytes(image), dtype=np.uint8) for image in images] if isinstance(images, list) else images, dtype=np.uint8)
+        if images.ndim != 2 or images.shape[1] != RAM_SIZE:
+            raise ValueError("Images must be an N x " + str(RAM_SIZE) + " array of RAM bytes")
+
+        # Opcodes are decoded with the same table the microcode ROM is generated from
+        self.opcodes = dict(emulate.generator.instructions)
+        self.cycleTable = np.array(emulate.opcodeCycles(rom or emulate.loadRom()), dtype=np.int64)
+
+        self.images = images.copy()
+        self.maxOutputs = maxOutputs
+        self.reset()
+
+    # Put every machine back into its power on state with a fresh copy of its RAM image
+    def reset(self):
+        count = len(self.images)
+        self.index = np.arange(count)
+        self.ram = self.images.copy()
+        self.a = np.zeros(count, dtype=np.int32)
+        self.b = np.zeros(count, dtype=np.int32)
+        self.pc = np.zeros(count, dtype=np.int32)
+        self.out = np.zeros(count, dtype=np.int32)
+        self.carry = np.zeros(count, dtype=bool)
+        self.zero = np.zeros(count, dtype=bool)
+        self.halted = np.zeros(count, dtype=bool)
+        self.cycles = np.zeros(count, dtype=np.int64)
+        self.instructions = np.zeros(count, dtype=np.int64)
+
+        # Every OUT is recorded up to maxOutputs per machine, outCount keeps counting past that
+        self.outputs = np.zeros((count, self.maxOutputs), dtype=np.uint8)
+        self.outCount = np.zeros(count, dtype=np.int64)
+
+    # Execute one instruction on every machine that hasn't halted
+    # Returns the number of machines still running
+    def step(self) -> int:
+        running = ~self.halted
+        index = self.index
+
+        # Fetch, every machine reads its own instruction and operand
+        instruction = self.ram[index, self.pc]
+        opcode = instruction >> 4
+        operand = (instruction & 0x0f).astype(np.intp)
+        value = self.ram[index, operand].astype(np.int32)
+
+        isOp = lambda mnemonic: running & (opcode == self.opcodes[mnemonic])
+        lda, add, sub, sta = isOp("LDA"), isOp("ADD"), isOp("SUB"), isOp("STA")
+        ldi, jmp, jc, jz = isOp("LDI"), isOp("JMP"), isOp("JC"), isOp("JZ")
+        clr, out, hlt = isOp("CLR"), isOp("OUT"), isOp("HLT")
+
+        # Memory writes and outputs use A from before this instruction
+        if sta.any():
+            self.ram[index[sta], operand[sta]] = self.a[sta]
+
+        if out.any():
+            record = out & (self.outCount < self.maxOutputs)
+            self.outputs[index[record], self.outCount[record]] = self.a[record]
+            self.outCount += out
+        self.out = np.where(out, self.a, np.where(clr, 0, self.out))
+
+        # ALU, ADD and SUB load B from RAM and latch the flags
+        alu = add | sub
+        total = np.where(sub, self.a + (0xff - value) + 1, self.a + value)
+        self.b = np.where(alu, value, self.b)
+        self.carry = np.where(alu, total > 0xff, self.carry)
+        self.zero = np.where(alu, (total & 0xff) == 0, self.zero)
+        self.a = np.where(alu, total & 0xff, np.where(lda, value, np.where(ldi, operand, self.a)))
+
+        # The fetch always counts the program counter up, jumps then overwrite it
+        jump = jmp | (jc & self.carry) | (jz & self.zero)
+        self.pc = np.where(jump, operand, np.where(running, (self.pc + 1) & 0x0f, self.pc))
+
+        self.cycles += np.where(running, self.cycleTable[opcode], 0)
+        self.instructions += running
+        self.halted |= hlt
+        return int(np.count_nonzero(~self.halted))
+
+    # Step every machine until all have halted or the instruction budget runs out
+    # Returns True if every machine halted
+    def run(self, maxInstructions: int = 1_000_000) -> bool:
+        for _ in range(maxInstructions):
+            if self.step() == 0:
+                return True
+
+        return bool(self.halted.all())
+
+    # Get the recorded outputs of a single machine
+    def outputsOf(self, machine: int) -> typing.List[int]:
+        return self.outputs[machine, :min(int(self.outCount[machine]), self.maxOutputs)].tolist()
+
+
+# Function for building one RAM image per value, each a copy of the base image with a single address set to that value
+# This is the equivalent of re-assembling a program with a different 'set' directive for every value
+def sweepImages(image: bytes, address: int, values: typing.Iterable[int]) -> np.ndarray:
+    values = np.fromiter(values, dtype=np.uint8)
+    images = np.tile(np.frombuffer(bytes(image), dtype=np.uint8), (len(values), 1))
+    images[:, address] = values
+    return images
+
+
+def main():
+    args = argParse()
+
+    try:
+        image = emulate.loadImage(args.image)
+        rom = emulate.loadRom(args.rom)
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+    except emulate.loadAssembler().AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+
+    values = range(0, 256)
+    machines = BatchSAP1(sweepImages(image, args.sweep, values), rom, args.max_outputs)
+    machines.run(args.max_instructions)
+
+    print("value  halted  instructions  cycles  outputs")
+    for machine, value in enumerate(values):
+        outputs = machines.outputsOf(machine)
+        print(f'{value:5d}  {str(bool(machines.halted[machine])):6s}  {machines.instructions[machine]:12d}  {machines.cycles[machine]:6d}  ' +
+              ' '.join(str(output) for output in outputs[:8]) + (' ...' if machines.outCount[machine] > 8 else ''))
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run a program once for every value of a RAM address, all in lockstep')
+    parser.add_argument('image', type=str, help="Program to run, either an assembled image or a '.sap' source")
+    parser.add_argument('--sweep', type=lambda value: int(value, 0), required=True, help="RAM address to sweep through all 256 values, e.g. 0xf")
+    parser.add_argument('--rom', type=str, default=emulate.DEFAULT_ROM, help="Microcode ROM used for cycle counts. Default -> microcode-rom")
+    parser.add_argument('--max-instructions', type=int, default=100_000, help="Stop after this many instructions. Default -> 100000")
+    parser.add_argument('--max-outputs', type=int, default=256, help="Outputs recorded per machine. Default -> 256")
+    args = parser.parse_args()
+
+    if not 0 <= args.sweep < RAM_SIZE:
+        parser.error("--sweep " + hex(args.sweep) + " is not a RAM address, it has to be 0x0 to " + hex(RAM_SIZE - 1))
+    return args
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
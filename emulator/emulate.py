@@ -0,0 +1,565 @@
+import argparse
+from dataclasses import dataclass
+import importlib.util
+import operator
+import os
+import pathlib
+import re
+import sys
+import typing
+
+
+# The microcode generator and ROM live in the root of the project
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSEMBLER_DIR = os.path.join(ROOT_DIR, "assembler")
+DEFAULT_ROM = os.path.join(ROOT_DIR, "microcode-rom")
+
+
+# Function for importing the microcode generator so the emulator shares its bit definitions
+# The generator's file name isn't a valid module name, so it has to be loaded from its path
+def loadGenerator():
+    spec = importlib.util.spec_from_file_location("micro_code_generator", os.path.join(ROOT_DIR, "micro-code_generator.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Function for importing the assembler so '.sap' sources can be run directly
+def loadAssembler():
+    if ASSEMBLER_DIR not in sys.path:
+        sys.path.insert(0, ASSEMBLER_DIR)
+
+    import assemble
+    return assemble
+
+
+# Function for importing the OCU generator, its display lookup turns output values into what the display shows
+def loadOCU():
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+
+    import OCU_generator
+    return OCU_generator
+
+
+generator = loadGenerator()
+
+# Compiled dispatch tables keyed by ROM contents, compiling is only ever done once per ROM
+compiledRoms: typing.Dict[typing.Tuple[int, ...], typing.Tuple[typing.List[typing.Callable], typing.List[int]]] = {}
+
+
+@dataclass
+class LoopReport:
+    """Class describing an infinite loop the emulator ran into"""
+    length: int
+    cycleLength: int
+    outputs: typing.List[int]
+    instructions: int
+    cycles: int
+
+
+# Every register, flag and counter of the machine, the order snapshots store them in
+MACHINE_STATE = ('a', 'b', 'pc', 'mar', 'ir', 'out', 'carry', 'zero', 'step', 'halted', 'cycles', 'instructions')
+getMachineState = operator.attrgetter(*MACHINE_STATE)
+
+
+class SAP1:
+    """Headless SAP-1 that executes the control words of a microcode ROM one T-state at a time"""
+
+    # The whole machine is a handful of small ints and a 16 byte RAM, slots keep it compact and quick to copy
+    __slots__ = ('rom', 'compiled', 'image', 'ram', 'outputs') + MACHINE_STATE
+
+    def __init__(self, rom: typing.List[int], image: bytes = bytes(16), compiled: bool = False):
+        # Micro-code ROM Addressing scheme (see micro-code_generator.py):
+        #   i i i i t t t
+        self.rom = list(rom)
+
+        # Fast mode executes a whole instruction per call through a table compiled from the ROM
+        self.compiled = compileRom(self.rom) if compiled else None
+        self.reset(image)
+
+    # Put the machine back into its power on state with a fresh copy of the RAM image
+    def reset(self, image: bytes = None):
+        if image is not None:
+            self.image = bytes(image)
+
+        self.ram = bytearray(self.image)
+        self.a = 0
+        self.b = 0
+        self.pc = 0
+        self.mar = 0
+        self.ir = 0
+        self.out = 0
+        self.carry = False
+        self.zero = False
+        self.step = 0
+        self.halted = False
+        self.outputs: typing.List[int] = []
+        self.cycles = 0
+        self.instructions = 0
+
+    # Capture the whole machine state, registers, step counter, RAM and how many values were output so far
+    # The outputs only ever grow, so their count is enough to roll them back and a snapshot costs the same however long the machine ran
+    # Returns an opaque snapshot for restore or fork, it never changes as the machine runs on
+    def snapshot(self) -> tuple:
+        return getMachineState(self), bytes(self.ram), len(self.outputs)
+
+    # Put the machine back into the state of a snapshot, taken from this machine or any other on the same ROM
+    # Values output after the snapshot was taken are dropped, the ones before it are whatever this machine output
+    def restore(self, snapshot: tuple):
+        state, ram, outputCount = snapshot
+        for name, value in zip(MACHINE_STATE, state):
+            setattr(self, name, value)
+        self.ram[:] = ram
+        del self.outputs[outputCount:]
+
+    # Make an independent copy of the machine, from its current state or from a snapshot
+    # The ROM and its compiled dispatch table are shared, so thousands of branches can resume from one prefix cheaply
+    def fork(self, snapshot: tuple = None) -> 'SAP1':
+        machine = SAP1.__new__(SAP1)
+        machine.rom, machine.compiled, machine.image = self.rom, self.compiled, self.image
+        if snapshot is None:
+            snapshot = self.snapshot()
+
+        # The branch starts with the outputs this machine had made by the snapshot
+        machine.ram = bytearray(16)
+        machine.outputs = self.outputs[:snapshot[2]]
+        machine.restore(snapshot)
+        return machine
+
+    # Execute a single T-state
+    def microStep(self):
+        self.runMicrocode(1)
+
+    # Execute T-states until the current instruction has finished
+    def stepInstruction(self):
+        if self.compiled is not None and self.step == 0:
+            self.runCompiled(maxInstructions=1)
+            return
+
+        self.runMicrocode(1)
+        while self.step != 0 and not self.halted:
+            self.runMicrocode(1)
+
+    # Execute until the machine halts or the cycle budget runs out
+    # Returns True if the machine halted
+    def run(self, maxCycles: int = None) -> bool:
+        if self.compiled is not None:
+            return self.runCompiled(maxCycles)
+
+        return self.runMicrocode(maxCycles)
+
+    # Everything that decides what the machine does next, only meaningful between instructions
+    def stateKey(self) -> tuple:
+        return (self.pc, self.a, self.b, self.carry, self.zero, self.out, bytes(self.ram))
+
+    # Execute until the machine halts, the cycle budget runs out or the machine is caught in an infinite loop
+    # The whole machine state is tiny, so a state that comes around again means the program will never halt
+    #   brent -> Brent's cycle detection, constant memory, finds the loop within a few trips of entering it
+    #   cache -> remembers up to cacheSize states and finds a loop that fits in them on its first repeat,
+    #            once the cache is full the loop is longer than that and Brent's algorithm takes over
+    # Returns a report of the loop or None if the machine halted or ran out of cycles
+    def runDetectingLoops(self, maxCycles: int = None, method: str = 'brent', cacheSize: int = 1 << 16) -> LoopReport:
+        # States are only compared between instructions
+        while self.step != 0 and not self.halted:
+            self.microStep()
+
+        limit = None if maxCycles is None else self.cycles + maxCycles
+        inBudget = lambda: not self.halted and (limit is None or self.cycles < limit)
+        report = lambda instructions, cycles, outputs: LoopReport(self.instructions - instructions, self.cycles - cycles, self.outputs[outputs:], self.instructions, self.cycles)
+
+        if method == 'cache':
+            seen: typing.Dict[tuple, typing.Tuple[int, int, int]] = {}
+            while inBudget():
+                key = self.stateKey()
+                if key in seen:
+                    return report(*seen[key])
+
+                # Keep memory bounded, a loop longer than the cache would never repeat a cached state
+                if len(seen) == cacheSize:
+                    break
+                seen[key] = (self.instructions, self.cycles, len(self.outputs))
+                self.stepInstruction()
+            else:
+                return None
+            seen.clear()
+
+        elif method != 'brent':
+            raise ValueError("Unknown loop detection method '" + method + "'")
+
+        # Brent's algorithm, the tortoise jumps to the hare every power of two steps
+        tortoise = self.stateKey()
+        mark = (self.instructions, self.cycles, len(self.outputs))
+        power = length = 1
+        if inBudget():
+            self.stepInstruction()
+        while inBudget():
+            if self.stateKey() == tortoise:
+                return report(*mark)
+
+            if power == length:
+                tortoise = self.stateKey()
+                mark = (self.instructions, self.cycles, len(self.outputs))
+                power *= 2
+                length = 0
+
+            self.stepInstruction()
+            length += 1
+
+        return None
+
+    # Execute whole instructions through the compiled dispatch table
+    # The budgets are only checked between instructions, so the last instruction may run past maxCycles
+    # Returns True if the machine halted
+    def runCompiled(self, maxCycles: int = None, maxInstructions: int = None) -> bool:
+        # Finish off an instruction that was started one micro-step at a time
+        while self.step != 0 and not self.halted:
+            self.runMicrocode(1)
+
+        handlers, costs = self.compiled
+        ram = self.ram
+        cycles, instructions = self.cycles, self.instructions
+        cycleLimit = -1 if maxCycles is None else cycles + maxCycles
+        instructionLimit = -1 if maxInstructions is None else instructions + maxInstructions
+
+        while not self.halted and instructions != instructionLimit and (cycleLimit == -1 or cycles < cycleLimit):
+            # The hardwired fetch loads the instruction register from RAM at the program counter
+            opcode = ram[self.pc] >> 4
+            handlers[opcode](self)
+            cycles += costs[opcode]
+            instructions += 1
+
+        self.cycles, self.instructions = cycles, instructions
+        return self.halted
+
+    # Execute T-states, one control word at a time, until the machine halts or the cycle budget runs out
+    # A trace (see tracer.py) gets every T-state's control word and bus along with the registers it started from
+    # Returns True if the machine halted
+    def runMicrocode(self, maxCycles: int = None, trace=None) -> bool:
+        # Pull everything into locals, the loop below is the hot path of the emulator
+        HLT, MI, RI, RO, II, IO = generator.HLT, generator.MI, generator.RI, generator.RO, generator.II, generator.IO
+        AI, AO, BI, BO, EO, SO = generator.AI, generator.AO, generator.BI, generator.BO, generator.EO, generator.SO
+        FI, OI, OC, CE, CI, CO = generator.FI, generator.OI, generator.OC, generator.CE, generator.CI, generator.CO
+        JC, JZ, NXT = generator.JC, generator.JZ, generator.NXT
+        FETCH = generator.FETCH
+        DRIVERS = RO | IO | AO | BO | EO | CO
+        ALU = EO | FI
+
+        rom, ram, outputs = self.rom, self.ram, self.outputs
+        a, b, pc, mar, ir, out = self.a, self.b, self.pc, self.mar, self.ir, self.out
+        carry, zero, step = self.carry, self.zero, self.step
+        cycles, instructions = self.cycles, self.instructions
+        halted = self.halted
+        limit = -1 if maxCycles is None else cycles + maxCycles
+        record = trace.record if trace is not None else None
+
+        while not halted and cycles != limit:
+            # The fetch cycle is hardwired, everything after it comes from the ROM
+            if step < 2:
+                word = FETCH[step]
+                if step == 0:
+                    instructions += 1
+            else:
+                word = rom[(ir >> 4) << 3 | step]
+            cycles += 1
+
+            # Compute the ALU output from the registers as they are during this T-state
+            if word & ALU:
+                if word & SO:
+                    total = a + (~b & 0xff) + 1
+                else:
+                    total = a + b
+                result = total & 0xff
+
+            # Put the bus drivers onto the bus, conflicting drivers resolve as a wired-OR
+            bus = 0
+            if word & DRIVERS:
+                if word & RO:
+                    bus |= ram[mar]
+                if word & IO:
+                    bus |= ir & 0x0f
+                if word & AO:
+                    bus |= a
+                if word & BO:
+                    bus |= b
+                if word & EO:
+                    bus |= result
+                if word & CO:
+                    bus |= pc
+
+            if record is not None:
+                record(word, bus, pc, a, b, mar, carry, zero)
+
+            # Latch the bus into every register that loads from it
+            if word & RI:
+                ram[mar] = bus
+            if word & MI:
+                mar = bus & 0x0f
+            if word & II:
+                ir = bus
+            if word & AI:
+                a = bus
+            if word & BI:
+                b = bus
+            if word & OI:
+                out = bus
+                outputs.append(bus)
+            if word & OC:
+                out = 0
+
+            # Program counter, a load takes priority over counting
+            if word & CE:
+                pc = (pc + 1) & 0x0f
+            if word & CI:
+                pc = bus & 0x0f
+            if (word & JC and carry) or (word & JZ and zero):
+                pc = ir & 0x0f
+
+            # Flags are latched after the conditional jumps have looked at them
+            if word & FI:
+                carry = total > 0xff
+                zero = result == 0
+
+            if word & HLT:
+                halted = True
+
+            # NXT ends the instruction, otherwise move on to the next micro-step
+            if word & NXT:
+                step = 0
+            else:
+                step = (step + 1) & 0x07
+
+        self.a, self.b, self.pc, self.mar, self.ir, self.out = a, b, pc, mar, ir, out
+        self.carry, self.zero, self.step = carry, zero, step
+        self.cycles, self.instructions = cycles, instructions
+        self.halted = halted
+        return halted
+
+
+# Function for compiling a microcode ROM into a 16 entry dispatch table
+# Each opcode's micro-steps, fetch included and up to the first NXT or HLT, become a single python function
+# Returns the handlers along with the T-states each opcode takes
+def compileRom(rom: typing.List[int]) -> typing.Tuple[typing.List[typing.Callable], typing.List[int]]:
+    key = tuple(rom)
+    if key in compiledRoms:
+        return compiledRoms[key]
+
+    # Dispatching on the opcode before the handler runs relies on the fetch loading IR from RAM at PC
+    if generator.FETCH != [generator.CO|generator.MI, generator.RO|generator.II|generator.CE]:
+        raise ValueError("Compiled mode requires the standard fetch cycle [CO|MI, RO|II|CE]")
+
+    registers = ['a', 'b', 'pc', 'mar', 'ir', 'out', 'carry', 'zero', 'halted', 'step']
+    handlers = []
+    for opcode in range(16):
+        body = []
+        for step in range(8):
+            word = generator.FETCH[step] if step < 2 else rom[opcode << 3 | step]
+            body += compileWord(word)
+
+            # Halting leaves the step counter where the hardware would
+            if word & generator.HLT:
+                body.append("step = " + str(0 if word & generator.NXT else (step + 1) & 0x07))
+                break
+            if word & generator.NXT:
+                break
+
+        # Only move the registers the handler actually uses in and out of the machine
+        used = [register for register in registers if re.search(r'\b' + register + r'\b', '\n'.join(body))]
+        assigned = [register for register in used if any(line.startswith(register + ' = ') for line in body)]
+
+        source = "def handler(machine):\n"
+        source += "    ram, outputs = machine.ram, machine.outputs\n"
+        source += ''.join("    " + register + " = machine." + register + "\n" for register in used)
+        source += ''.join("    " + line + "\n" for line in body)
+        source += ''.join("    machine." + register + " = " + register + "\n" for register in assigned)
+
+        namespace = {}
+        exec(compile(source, "<microcode opcode " + f'{opcode:x}' + ">", 'exec'), namespace)
+        handlers.append(namespace['handler'])
+
+    compiledRoms[key] = (handlers, opcodeCycles(rom))
+    return compiledRoms[key]
+
+
+# Function for translating a single control word into python statements
+# The statements follow the exact order SAP1.runMicrocode applies the control bits in
+def compileWord(word: int) -> typing.List[str]:
+    g = generator
+    lines = []
+
+    if word & (g.EO | g.FI):
+        lines.append("total = a + (~b & 0xff) + 1" if word & g.SO else "total = a + b")
+        lines.append("result = total & 0xff")
+
+    drivers = []
+    if word & g.RO:
+        drivers.append("ram[mar]")
+    if word & g.IO:
+        drivers.append("(ir & 0x0f)")
+    if word & g.AO:
+        drivers.append("a")
+    if word & g.BO:
+        drivers.append("b")
+    if word & g.EO:
+        drivers.append("result")
+    if word & g.CO:
+        drivers.append("pc")
+    lines.append("bus = " + (" | ".join(drivers) if drivers else "0"))
+
+    if word & g.RI:
+        lines.append("ram[mar] = bus")
+    if word & g.MI:
+        lines.append("mar = bus & 0x0f")
+    if word & g.II:
+        lines.append("ir = bus")
+    if word & g.AI:
+        lines.append("a = bus")
+    if word & g.BI:
+        lines.append("b = bus")
+    if word & g.OI:
+        lines.append("out = bus")
+        lines.append("outputs.append(bus)")
+    if word & g.OC:
+        lines.append("out = 0")
+
+    if word & g.CE:
+        lines.append("pc = (pc + 1) & 0x0f")
+    if word & g.CI:
+        lines.append("pc = bus & 0x0f")
+    conditions = (["carry"] if word & g.JC else []) + (["zero"] if word & g.JZ else [])
+    if conditions:
+        lines.append("if " + " or ".join(conditions) + ": pc = ir & 0x0f")
+
+    if word & g.FI:
+        lines.append("carry = total > 0xff")
+        lines.append("zero = result == 0")
+
+    if word & g.HLT:
+        lines.append("halted = True")
+
+    return lines
+
+
+# Function for counting the T-states taken by each of the 16 opcodes
+# This is the two fetch steps plus every ROM step up to and including the first one that has NXT (or HLT) set
+def opcodeCycles(rom: typing.List[int]) -> typing.List[int]:
+    cycles = []
+    for opcode in range(16):
+        steps = 2
+        for step in range(2, 8):
+            steps += 1
+            if rom[opcode << 3 | step] & (generator.NXT | generator.HLT):
+                break
+        cycles.append(steps)
+
+    return cycles
+
+
+# Function for reading the words out of a Logisim hex file
+# Handles both the 'plain' and 'addressed' variants along with run length encoded words such as '4*00'
+def readHexWords(filePath: os.path) -> typing.List[int]:
+    file = open(filePath, 'r')
+    header = file.readline().strip()
+    contents = file.read()
+    file.close()
+
+    if not header.startswith('v3.0 hex words'):
+        raise ValueError("'" + str(filePath) + "' is not a Logisim 'v3.0 hex words' file")
+
+    words = []
+    for line in contents.splitlines():
+        # Comments are allowed in Logisim hex files
+        line = line.split('#', 1)[0]
+        parts = line.split()
+
+        # Addressed files start every line with the address of its first word
+        if header.endswith('addressed') and parts:
+            address = int(parts.pop(0).rstrip(':'), 16)
+            words += [0] * (address - len(words))
+
+        for part in parts:
+            if '*' in part:
+                count, word = part.split('*')
+                words += [int(word, 16)] * int(count)
+                continue
+            words.append(int(part, 16))
+
+    return words
+
+
+# Function for loading the microcode ROM, always returning the full 128 words
+def loadRom(filePath: os.path = DEFAULT_ROM) -> typing.List[int]:
+    words = readHexWords(filePath)
+    if len(words) > 128:
+        raise ValueError("Microcode ROM '" + str(filePath) + "' has " + str(len(words)) + " words, expected 128")
+
+    return words + [0] * (128 - len(words))
+
+
+# Function for loading a program RAM image
+# Assembler output images are loaded as is, in any of its formats (Logisim, raw or Intel HEX), and '.sap' sources are assembled first
+# The format is guessed from the file unless one is given
+def loadImage(filePath: os.path, imageFormat: str = None) -> bytes:
+    assemble = loadAssembler()
+    if pathlib.Path(filePath).suffix == '.sap':
+        return assemble.assembleSource(assemble.readFile(filePath))
+
+    return assemble.readImage(filePath, imageFormat=imageFormat)
+
+
+def main():
+    args = argParse()
+
+    try:
+        machine = SAP1(loadRom(args.rom), loadImage(args.image, args.format), args.fast)
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+    except loadAssembler().AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+
+    loop = None
+    if args.detect_loops:
+        loop = machine.runDetectingLoops(args.max_cycles, args.detect_loops)
+    else:
+        machine.run(args.max_cycles)
+
+    ocu = loadOCU()
+    print("Output: " + ' '.join(ocu.Display_Value(value, args.signed) for value in machine.outputs))
+    if loop is not None:
+        print("Infinite loop of " + str(loop.length) + " instructions (" + str(loop.cycleLength) + " cycles) per trip, found after " + str(loop.instructions) + " instructions, " + str(loop.cycles) + " cycles")
+        print("Output per trip: " + ' '.join(ocu.Display_Value(value, args.signed) for value in loop.outputs))
+        print("A=" + str(machine.a) + " B=" + str(machine.b) + " PC=" + str(machine.pc) + " CF=" + str(int(machine.carry)) + " ZF=" + str(int(machine.zero)))
+        sys.exit(3)
+
+    print(("Halted" if machine.halted else "Stopped") + " after " + str(machine.instructions) + " instructions, " + str(machine.cycles) + " cycles")
+    print("A=" + str(machine.a) + " B=" + str(machine.b) + " PC=" + str(machine.pc) + " CF=" + str(int(machine.carry)) + " ZF=" + str(int(machine.zero)))
+
+    # Let scripts tell a halted program apart from one that ran out of cycles (or loops forever)
+    if not machine.halted:
+        sys.exit(2)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='The headless SAP-1 emulator!')
+    parser.add_argument('image', type=str, help="Program to run, either an assembled image or a '.sap' source")
+    parser.add_argument('-f', '--format', choices=['logisim', 'raw', 'ihex'], default=None, help="Format of an assembled image. Default -> '.hex' files are Intel HEX, Logisim images by their header, anything else raw")
+    parser.add_argument('--rom', type=str, default=DEFAULT_ROM, help="Microcode ROM to execute. Default -> microcode-rom")
+    parser.add_argument('--max-cycles', type=int, default=10_000_000, help="Stop after this many T-states. Default -> 10000000")
+    parser.add_argument('--fast', action='store_true', help="Run whole instructions through a dispatch table compiled from the ROM")
+    parser.add_argument('--signed', action='store_true', help="Show output the way the display does in two's complement mode")
+    parser.add_argument('--detect-loops', choices=['brent', 'cache'], default=None, help="Stop as soon as the program is caught in an infinite loop, using Brent's algorithm or a bounded state cache (which hands loops longer than it over to Brent's algorithm)")
+    return parser.parse_args()
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import pathlib
+import sys
+import typing
+
+import emulate
+
+
+class Profiler:
+    """Class for running a program on the microcode emulator and recording where its cycles go"""
+
+    def __init__(self, machine: emulate.SAP1):
+        self.machine = machine
+        self.mnemonics = {opcode: mnemonic for mnemonic, opcode in emulate.generator.instructions.items()}
+        self.branchFlags = {self.opcodeOf("JC"): "carry", self.opcodeOf("JZ"): "zero"}
+        self.jumps = {self.opcodeOf("JMP"), *self.branchFlags}
+
+        # Everything is indexed by RAM address or by opcode, the whole machine only has 16 of each
+        self.addressCounts = [0] * 16
+        self.addressCycles = [0] * 16
+        self.opcodeCounts = [0] * 16
+        self.opcodeCycles = [0] * 16
+        self.taken = [0] * 16
+        self.notTaken = [0] * 16
+
+        # Backward jumps that were taken, keyed by (target, source), these are the program's loops
+        self.backEdges: typing.Dict[typing.Tuple[int, int], int] = {}
+
+    def opcodeOf(self, mnemonic: str) -> int:
+        return emulate.generator.instructions[mnemonic]
+
+    # Execute one instruction at a time until the machine halts or the cycle budget runs out
+    # Cycles are taken from the machine itself, so an instruction that ends early on NXT is only charged for the T-states it used
+    # Returns True if the machine halted
+    def run(self, maxCycles: int = None) -> bool:
+        machine = self.machine
+        limit = None if maxCycles is None else machine.cycles + maxCycles
+
+        while not machine.halted and (limit is None or machine.cycles < limit):
+            address = machine.pc
+            cycles = machine.cycles
+            flags = {"carry": machine.carry, "zero": machine.zero}
+
+            machine.stepInstruction()
+
+            spent = machine.cycles - cycles
+            opcode = machine.ir >> 4
+            self.addressCounts[address] += 1
+            self.addressCycles[address] += spent
+            self.opcodeCounts[opcode] += 1
+            self.opcodeCycles[opcode] += spent
+
+            # A conditional jump is taken when its flag was set going in, the target alone can't tell (it may be the next address)
+            jumped = opcode in self.jumps
+            if opcode in self.branchFlags:
+                jumped = flags[self.branchFlags[opcode]]
+                if jumped:
+                    self.taken[address] += 1
+                else:
+                    self.notTaken[address] += 1
+
+            # Only a jump that was taken makes a back edge, falling through at address 15 wraps the PC around to 0 but isn't a loop
+            if jumped and machine.pc <= address:
+                edge = (machine.pc, address)
+                self.backEdges[edge] = self.backEdges.get(edge, 0) + 1
+
+        return machine.halted
+
+    # Build the profile as plain python data, ready to be written out as JSON
+    # The source map links addresses back to the '.sap' file, see assembleWithSourceMap
+    def report(self, sourceMap: dict = None) -> dict:
+        machine = self.machine
+        sourceMap = sourceMap or {"lines": {}, "labels": {}}
+        lines = sourceMap["lines"]
+        labels = {address: label for label, address in sourceMap["labels"].items()}
+        source = lambda address: {"line": lines[address][0], "source": lines[address][1]} if address in lines else {"line": None, "source": None}
+
+        addresses = []
+        for address in range(16):
+            if self.addressCounts[address]:
+                addresses.append({"address": address, "label": labels.get(address), **source(address),
+                                  "count": self.addressCounts[address], "cycles": self.addressCycles[address]})
+
+        opcodes = {}
+        for opcode in range(16):
+            if self.opcodeCounts[opcode]:
+                opcodes[self.mnemonics.get(opcode, hex(opcode))] = {"count": self.opcodeCounts[opcode], "cycles": self.opcodeCycles[opcode]}
+
+        branches = []
+        for address in range(16):
+            if self.taken[address] or self.notTaken[address]:
+                branches.append({"address": address, "label": labels.get(address), **source(address),
+                                 "taken": self.taken[address], "notTaken": self.notTaken[address]})
+
+        # A loop is the stretch of code between a backward jump and its target, hottest first
+        loops = []
+        for (start, end), trips in self.backEdges.items():
+            body = range(start, end + 1)
+            loops.append({"label": labels.get(start), "start": start, "end": end, "trips": trips,
+                          "instructions": sum(self.addressCounts[address] for address in body),
+                          "cycles": sum(self.addressCycles[address] for address in body),
+                          "lines": [lines[address][0] for address in body if address in lines]})
+        loops.sort(key=lambda loop: loop["cycles"], reverse=True)
+
+        return {
+            "halted": machine.halted,
+            "instructions": machine.instructions,
+            "cycles": machine.cycles,
+            "outputs": machine.outputs,
+            "addresses": addresses,
+            "opcodes": opcodes,
+            "branches": branches,
+            "loops": loops,
+        }
+
+
+# Function for assembling a '.sap' source while keeping track of where everything came from
+# Returns the RAM image along with a source map of address -> (line number, source text) and the label addresses
+def assembleWithSourceMap(filePath: str) -> typing.Tuple[bytes, dict]:
+    assemble = emulate.loadAssembler()
+    source = assemble.readFile(filePath)
+    text = source.splitlines()
+
+    program, symbols = assemble.resolveLabels(assemble.stripFile(source))
+    image = assemble.assemble(program)
+
+    # Instructions fill RAM from address 0 in order, set directives name their address
+    lines = {}
+    for address, token in enumerate(token for token in program if token.mnemonic != 'set'):
+        lines[address] = (token.lineNumber, text[token.lineNumber - 1].strip())
+    for token in program:
+        if token.mnemonic == 'set':
+            lines[int(token.args[0], 16)] = (token.lineNumber, text[token.lineNumber - 1].strip())
+
+    return image, {"lines": lines, "labels": symbols}
+
+
+def main():
+    args = argParse()
+    assemble = emulate.loadAssembler()
+
+    try:
+        rom = emulate.loadRom(args.rom)
+        if pathlib.Path(args.image).suffix == '.sap':
+            image, sourceMap = assembleWithSourceMap(args.image)
+        else:
+            image, sourceMap = emulate.loadImage(args.image), None
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+    except assemble.AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting emulation....\n")
+        sys.exit(1)
+
+    profiler = Profiler(emulate.SAP1(rom, image))
+    profiler.run(args.max_cycles)
+    profile = {"image": args.image, "rom": args.rom, **profiler.report(sourceMap)}
+
+    if args.output is None:
+        print(json.dumps(profile, indent=2))
+    else:
+        assemble.writeFile(args.output, json.dumps(profile, indent=2) + "\n")
+
+    if not profiler.machine.halted:
+        sys.exit(2)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Profile a program on the headless SAP-1 emulator and write the profile as JSON')
+    parser.add_argument('image', type=str, help="Program to run, a '.sap' source gets its profile mapped back to lines and labels")
+    parser.add_argument('--rom', type=str, default=emulate.DEFAULT_ROM, help="Microcode ROM to execute. Default -> microcode-rom")
+    parser.add_argument('--max-cycles', type=int, default=10_000_000, help="Stop after this many T-states. Default -> 10000000")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write the profile to this file instead of stdout")
+    return parser.parse_args()
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
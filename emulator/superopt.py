@@ -0,0 +1,301 @@
+import argparse
+import concurrent.futures
+from dataclasses import dataclass
+import sys
+import typing
+
+import emulate
+
+
+# Opcodes, decoded the same way the microcode ROM is generated
+ops = emulate.generator.instructions
+
+
+@dataclass
+class Solution:
+    """Class for a program found by the superoptimizer"""
+    image: bytes
+    codeMask: int
+    dataMask: int
+    size: int
+    cycles: int
+    instructions: int
+
+
+class Search:
+    """Depth first search over every program that fits a byte budget
+
+    RAM cells are only decided when the program first touches them. A cell that is executed branches over every
+    useful instruction, a cell that is read branches over the allowed constants and a cell that is only written
+    costs a byte but needs no value. Cells the program never touches are never enumerated at all.
+    """
+
+    def __init__(self, target: typing.List[int], budget: int, constants: typing.List[int], maxSteps: int, maxQuiet: int, costs: typing.List[int], objective: str):
+        self.target = target
+        self.budget = budget
+        self.constants = constants
+        self.maxSteps = maxSteps
+        self.maxQuiet = maxQuiet
+        self.costs = costs
+        self.objective = objective
+        self.best: Solution = None
+        self.writesA = {ops["LDA"], ops["ADD"], ops["SUB"], ops["LDI"]}
+
+        # Transposition table, the fewest cycles any branch has reached a machine state with
+        # Reaching a state again with as many cycles can't do any better (this also cuts infinite loops)
+        self.seen: typing.Dict[tuple, int] = {}
+
+    # Candidate instructions for a cell about to be executed
+    def alphabet(self, decided: int, pc: int) -> typing.List[int]:
+        # Every untouched cell is interchangeable as a data cell, so only the highest one is offered
+        known = [address for address in range(16) if decided & (1 << address) or address == pc]
+        fresh = [address for address in range(15, -1, -1) if address not in known][:1]
+        memory = known + fresh
+
+        candidates = []
+        for mnemonic in ("LDA", "ADD", "SUB", "STA"):
+            candidates += [ops[mnemonic] << 4 | address for address in memory]
+        candidates += [ops["LDI"] << 4 | value for value in range(0, 8)]
+        # Jumping to the next cell is a wasted byte and jumping to itself never gets anywhere
+        for mnemonic in ("JMP", "JC", "JZ"):
+            candidates += [ops[mnemonic] << 4 | address for address in range(16) if address != pc and address != (pc + 1) & 0x0f]
+        candidates += [ops["OUT"] << 4, ops["HLT"] << 4]
+        return candidates
+
+    # Run the machine from the given state, branching wherever an undecided cell is touched
+    def explore(self, image: bytearray, ram: bytearray, decided: int, code: int, data: int, pc: int, a: int, carry: bool, zero: bool, matched: int, used: int, cycles: int, steps: int, quiet: int):
+        target, costs = self.target, self.costs
+
+        while steps < self.maxSteps and quiet < self.maxQuiet:
+            # The fastest program so far can't be beaten by a branch that is already slower
+            if self.objective == 'cycles' and self.best is not None and cycles >= self.best.cycles:
+                return
+
+            # Executing an undecided cell, try every instruction in it
+            bit = 1 << pc
+            if not decided & bit:
+                if used == self.budget:
+                    return
+                opcodes = {ram[address] >> 4 for address in range(16) if decided & (1 << address)}
+                for byte in self.alphabet(decided, pc):
+                    if self.cellsNeeded(opcodes | {byte >> 4}, matched, a) > self.budget - used - 1:
+                        continue
+                    image[pc] = ram[pc] = byte
+                    self.explore(bytearray(image), bytearray(ram), decided | bit, code | bit, data, pc, a, carry, zero, matched, used + 1, cycles, steps, quiet)
+                return
+
+            key = (bytes(ram), decided, pc, a, carry, zero, matched, used)
+            if self.seen.get(key, cycles + 1) <= cycles:
+                return
+            self.seen[key] = cycles
+
+            opcode, operand = ram[pc] >> 4, ram[pc] & 0x0f
+            operandBit = 1 << operand
+
+            # Reading an undecided cell, try every allowed constant in it
+            if opcode in (ops["LDA"], ops["ADD"], ops["SUB"]) and not decided & operandBit:
+                if used == self.budget:
+                    return
+                for value in self.constants:
+                    image[operand] = ram[operand] = value
+                    self.explore(bytearray(image), bytearray(ram), decided | operandBit, code, data | operandBit, pc, a, carry, zero, matched, used + 1, cycles, steps, quiet)
+                return
+
+            # Writing an undecided cell, its starting value doesn't matter
+            if opcode == ops["STA"] and not decided & operandBit:
+                if used == self.budget:
+                    return
+                decided |= operandBit
+                used += 1
+
+            cycles += costs[opcode]
+            steps += 1
+            quiet += 1
+            pc = (pc + 1) & 0x0f
+
+            if opcode == ops["LDA"]:
+                a = ram[operand]
+            elif opcode == ops["ADD"] or opcode == ops["SUB"]:
+                total = a + (0xff - ram[operand]) + 1 if opcode == ops["SUB"] else a + ram[operand]
+                a = total & 0xff
+                carry, zero = total > 0xff, a == 0
+            elif opcode == ops["STA"]:
+                ram[operand] = a
+            elif opcode == ops["LDI"]:
+                a = operand
+            elif opcode == ops["JMP"] or (opcode == ops["JC"] and carry) or (opcode == ops["JZ"] and zero):
+                pc = operand
+            elif opcode == ops["OUT"]:
+                # Output has to follow the target exactly
+                if matched == len(target) or a != target[matched]:
+                    return
+                matched += 1
+                quiet = 0
+            elif opcode == ops["HLT"]:
+                if matched == len(target):
+                    self.record(Solution(bytes(image), code, data, used, cycles, steps))
+                return
+
+    # Lower bound on the cells still to be decided, a program needs a HLT and, while output is missing, an OUT
+    # and something that can get A to the next output value
+    # Once a STA has been placed the program could write its own instructions, so there is no bound
+    def cellsNeeded(self, opcodes: typing.Set[int], matched: int, a: int) -> int:
+        if ops["STA"] in opcodes:
+            return 0
+
+        needed = 0 if ops["HLT"] in opcodes else 1
+        if matched < len(self.target):
+            if ops["OUT"] not in opcodes:
+                needed += 1
+            if a != self.target[matched] and not opcodes & self.writesA:
+                needed += 1
+        return needed
+
+    # Keep a solution if it beats the best one so far
+    # Only programs that the real microcode and the assembler agree with are kept
+    def record(self, solution: Solution):
+        if self.best is not None and (solution.cycles, solution.size) >= (self.best.cycles, self.best.size):
+            return
+
+        if verifySolution(solution, self.target):
+            self.best = solution
+
+
+# Function for searching every program of a given byte budget that starts with a given first instruction
+# This is the unit of work handed to each process in the pool
+def searchFrom(target: typing.List[int], budget: int, first: int, constants: typing.List[int], maxSteps: int, maxQuiet: int, objective: str) -> Solution:
+    search = Search(target, budget, constants, maxSteps, maxQuiet, emulate.opcodeCycles(emulate.loadRom()), objective)
+    image = bytearray(16)
+    image[0] = first
+    search.explore(image, bytearray(image), 1, 1, 0, 0, 0, False, False, 0, 1, 0, 0, 0)
+    return search.best
+
+
+# Function for finding the smallest (or fastest) program whose output is exactly the target sequence
+# Budgets are searched in increasing size, the first instruction of each budget is spread across a process pool
+def superoptimize(target: typing.List[int], maxSize: int = 5, constants: typing.List[int] = (0, 1, 255), maxSteps: int = 1000, maxQuiet: int = 32, objective: str = 'size', workers: int = None) -> Solution:
+    constants = list(dict.fromkeys(constants))
+    firsts = Search(target, 0, constants, maxSteps, maxQuiet, [], objective).alphabet(0, 0)
+    best = None
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for budget in range(1, maxSize + 1):
+            count = len(firsts)
+            results = pool.map(searchFrom, [target] * count, [budget] * count, firsts, [constants] * count, [maxSteps] * count, [maxQuiet] * count, [objective] * count)
+            for solution in results:
+                if solution is not None and (best is None or (solution.cycles, solution.size) < (best.cycles, best.size)):
+                    best = solution
+
+            if objective == 'size' and best is not None:
+                return best
+
+    return best
+
+
+# Function for checking a solution against the microcode emulator and the assembler
+def verifySolution(solution: Solution, target: typing.List[int]) -> bool:
+    machine = emulate.SAP1(emulate.loadRom(), solution.image, compiled=True)
+    machine.run(solution.cycles)
+    if not machine.halted or machine.outputs != target:
+        return False
+
+    source = emitSource(solution)
+    if source is None:
+        return False
+
+    assemble = emulate.loadAssembler()
+    try:
+        image = assemble.assembleSource(source)
+    except assemble.AssemblyError:
+        return False
+
+    used = solution.codeMask | solution.dataMask
+    return all(image[address] == solution.image[address] for address in range(16) if used & (1 << address))
+
+
+# Function for turning a solution into '.sap' source the assembler accepts
+# Data after the last instruction becomes 'set' directives, anything inside the program has to be an instruction
+# Returns None if the layout can't be expressed as source
+def emitSource(solution: Solution) -> str:
+    mnemonics = {value: mnemonic.lower() for mnemonic, value in ops.items()}
+    withOperand = {"LDA", "ADD", "SUB", "STA", "LDI", "JMP", "JC", "JZ"}
+    jumps = {ops["JMP"], ops["JC"], ops["JZ"]}
+
+    end = max(address for address in range(16) if solution.codeMask & (1 << address))
+    targets = {solution.image[address] & 0x0f for address in range(end + 1) if solution.image[address] >> 4 in jumps and solution.codeMask & (1 << address)}
+
+    lines = ["; Found by the superoptimizer, " + str(solution.size) + " bytes, " + str(solution.cycles) + " cycles", ""]
+    for address in range(end + 1):
+        if address in targets:
+            lines.append("l" + f'{address:x}' + ":")
+
+        opcode, operand = solution.image[address] >> 4, solution.image[address] & 0x0f
+        mnemonic = mnemonics[opcode]
+        if mnemonic.startswith("res") or (mnemonic.upper() not in withOperand and operand != 0) or (mnemonic == "ldi" and operand > 7):
+            return None
+
+        if mnemonic.upper() not in withOperand:
+            lines.append(mnemonic)
+        elif opcode in jumps and solution.codeMask & (1 << address):
+            lines.append(mnemonic + " l" + f'{operand:x}')
+        else:
+            lines.append(mnemonic + " 0x" + f'{operand:x}')
+
+    # Jumps past the end of the program land on the first data cell
+    if any(target > end for target in targets):
+        return None
+
+    lines.append("")
+    for address in range(end + 1, 16):
+        if solution.dataMask & (1 << address) and solution.image[address] != 0:
+            lines.append("set 0x" + f'{address:x}' + ", " + str(solution.image[address]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    args = argParse()
+
+    solution = superoptimize(args.target, args.max_size, args.constants, args.max_steps, args.max_quiet, args.objective, args.jobs)
+    if solution is None:
+        printErr("[ERROR] No program of " + str(args.max_size) + " bytes or less produces that output")
+        sys.exit(1)
+
+    source = emitSource(solution)
+    if args.output is None:
+        print(source)
+        return
+
+    file = open(args.output, 'w')
+    file.write(source)
+    file.close()
+    print("Found a " + str(solution.size) + " byte program taking " + str(solution.cycles) + " cycles: " + args.output)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Search for the shortest or fastest SAP-1 program with a given output')
+    parser.add_argument('target', type=lambda value: int(value, 0), nargs='+', help="Exact sequence of OUT values the program must produce before halting")
+    parser.add_argument('--max-size', type=int, default=5, help="Largest program, in bytes, to search. Default -> 5")
+    parser.add_argument('--constants', type=lambda value: [int(part, 0) for part in value.split(',')], default=[0, 1, 255], help="Values data cells may start with. Default -> 0,1,255")
+    parser.add_argument('--max-steps', type=int, default=1000, help="Instructions a candidate may run before it is given up on. Default -> 1000")
+    parser.add_argument('--max-quiet', type=int, default=32, help="Instructions a candidate may run between two outputs (or before halting). Default -> 32")
+    parser.add_argument('--objective', choices=['size', 'cycles'], default='size', help="Minimize bytes (ties broken by cycles) or cycles. Default -> size")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes. Default -> number of CPUs")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write the program to this '.sap' file instead of printing it")
+    args = parser.parse_args()
+
+    # Data cells are RAM bytes, a constant that doesn't fit in one would only fail once the workers have started
+    for constant in args.constants:
+        if not 0 <= constant <= 255:
+            parser.error("--constants " + str(constant) + " doesn't fit in a byte, constants have to be 0 to 255")
+    return args
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import array
+from dataclasses import dataclass
+import struct
+import sys
+import typing
+
+import emulate
+
+
+# Every T-state is packed into one 64 bit slot of the ring buffer, low bits first:
+#   control word (24) | bus (8) | A (8) | B (8) | PC (4) | MAR (4) | carry (1) | zero (1)
+# The registers are the ones the T-state started with, so a RAM write is the bus going into RAM[MAR] when RI is set
+BUS_SHIFT = 24
+A_SHIFT = 32
+B_SHIFT = 40
+PC_SHIFT = 48
+MAR_SHIFT = 52
+CARRY_SHIFT = 56
+ZERO_SHIFT = 57
+
+# Trace files are this header followed by the records oldest first as little-endian 64 bit words
+#   magic, format version, bytes per record, cycle of the first record, number of records
+TRACE_MAGIC = b'SAPT'
+TRACE_FORMAT = 1
+TRACE_HEADER = struct.Struct('<4sHHQQ')
+
+
+@dataclass
+class TraceRecord:
+    """Class for one recorded T-state, the control word it ran, the bus it drove and the registers it started with"""
+    cycle: int
+    word: int
+    bus: int
+    a: int
+    b: int
+    pc: int
+    mar: int
+    carry: bool
+    zero: bool
+
+    # The RAM write this T-state made as (address, value), None if it didn't write
+    @property
+    def ramWrite(self) -> typing.Tuple[int, int]:
+        return (self.mar, self.bus) if self.word & emulate.generator.RI else None
+
+
+class Tracer:
+    """Class for recording every T-state a SAP1 executes into a fixed size ring buffer, and for stepping back through them"""
+
+    def __init__(self, machine: emulate.SAP1, capacity: int = 1 << 16, checkpointInterval: int = 1024):
+        self.machine = machine
+        self.capacity = capacity
+        self.checkpointInterval = checkpointInterval
+
+        # Preallocated once, recording a T-state is a single store into the next slot
+        self.buffer = array.array('Q', bytes(8 * capacity))
+
+        # Cycles [first, end) are recorded, the record of a cycle is in slot cycle % capacity
+        self.first = self.end = machine.cycles
+
+        # Machine snapshots every checkpointInterval cycles, going back restores one and runs forward from it
+        self.checkpoints: typing.List[typing.Tuple[int, tuple]] = [(machine.cycles, machine.snapshot())]
+
+        # Snapshots only hold how many values were output, so the values of the recorded history are kept here
+        self.outputs = machine.outputs
+
+    # Called by the emulator for every T-state it executes
+    def record(self, word: int, bus: int, pc: int, a: int, b: int, mar: int, carry: bool, zero: bool):
+        self.buffer[self.end % self.capacity] = (word | bus << BUS_SHIFT | a << A_SHIFT | b << B_SHIFT | pc << PC_SHIFT |
+                                                 mar << MAR_SHIFT | carry << CARRY_SHIFT | zero << ZERO_SHIFT)
+        self.end += 1
+
+    # Execute T-states while recording them, until the machine halts or the cycle budget runs out
+    # Running from a cycle that was stepped back to starts a new history, everything recorded after it is dropped
+    # Returns True if the machine halted
+    def run(self, maxCycles: int = None) -> bool:
+        machine = self.machine
+        if machine.cycles != self.end:
+            self.end = machine.cycles
+            self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint[0] <= machine.cycles]
+        self.outputs = machine.outputs
+
+        limit = None if maxCycles is None else machine.cycles + maxCycles
+        while not machine.halted and (limit is None or machine.cycles < limit):
+            # Run up to the next checkpoint boundary at most, so one is taken every checkpointInterval cycles
+            chunk = self.checkpointInterval - machine.cycles % self.checkpointInterval
+            if limit is not None:
+                chunk = min(chunk, limit - machine.cycles)
+            machine.runMicrocode(chunk, self)
+
+            if machine.cycles % self.checkpointInterval == 0 and machine.cycles > self.checkpoints[-1][0]:
+                self.checkpoints.append((machine.cycles, machine.snapshot()))
+
+            # Records older than the ring buffer are gone, and so are the checkpoints only they needed, memory stays bounded however long it runs
+            self.first = max(self.first, self.end - self.capacity)
+            self.pruneCheckpoints()
+        return machine.halted
+
+    # Execute T-states forward, recording them
+    def step(self, cycles: int = 1) -> bool:
+        return self.run(cycles)
+
+    # Go back T-states, no further than the oldest recorded cycle
+    def stepBack(self, cycles: int = 1):
+        self.goto(max(self.first, self.machine.cycles - cycles))
+
+    # Put the machine into the state it was in right before a recorded cycle ran, or at the end of the recording
+    # The emulator is deterministic, so restoring the last checkpoint before the cycle and running up to it rebuilds the exact state
+    def goto(self, cycle: int):
+        if not self.first <= cycle <= self.end:
+            raise ValueError("Cycle " + str(cycle) + " is not recorded, the trace holds cycles " + str(self.first) + " to " + str(self.end))
+
+        start, snapshot = max((checkpoint for checkpoint in self.checkpoints if checkpoint[0] <= cycle), key=lambda checkpoint: checkpoint[0])
+        self.machine.outputs = self.outputs[:snapshot[2]]
+        self.machine.restore(snapshot)
+        self.machine.runMicrocode(cycle - start)
+
+    # Only the newest checkpoint at or before the oldest record is still needed to reach every recorded cycle
+    def pruneCheckpoints(self):
+        while len(self.checkpoints) > 1 and self.checkpoints[1][0] <= self.first:
+            self.checkpoints.pop(0)
+
+    def __len__(self) -> int:
+        return self.end - self.first
+
+    # Get the record of a cycle
+    def __getitem__(self, cycle: int) -> TraceRecord:
+        if not self.first <= cycle < self.end:
+            raise IndexError("Cycle " + str(cycle) + " is not recorded, the trace holds cycles " + str(self.first) + " to " + str(self.end - 1))
+        return decodeRecord(cycle, self.buffer[cycle % self.capacity])
+
+    # Every record, oldest first
+    def __iter__(self) -> typing.Iterator[TraceRecord]:
+        for cycle in range(self.first, self.end):
+            yield self[cycle]
+
+    # Get the raw records oldest first, as a new array
+    def records(self) -> array.array:
+        start, count = self.first % self.capacity, len(self)
+        if start + count <= self.capacity:
+            return self.buffer[start:start + count]
+        return self.buffer[start:] + self.buffer[:start + count - self.capacity]
+
+    # Write the trace to a compact binary file, see TRACE_HEADER for the layout
+    def export(self, filePath: str):
+        records = self.records()
+        if sys.byteorder != 'little':
+            records.byteswap()
+
+        file = open(filePath, 'wb')
+        file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_FORMAT, records.itemsize, self.first, len(records)))
+        records.tofile(file)
+        file.close()
+
+
+# Function for unpacking a record out of its 64 bit slot
+def decodeRecord(cycle: int, packed: int) -> TraceRecord:
+    return TraceRecord(cycle, packed & 0xffffff, packed >> BUS_SHIFT & 0xff, packed >> A_SHIFT & 0xff, packed >> B_SHIFT & 0xff,
+                       packed >> PC_SHIFT & 0x0f, packed >> MAR_SHIFT & 0x0f, bool(packed >> CARRY_SHIFT & 1), bool(packed >> ZERO_SHIFT & 1))
+
+
+# Function for reading a trace file written by Tracer.export
+# Returns the cycle of the first record along with the packed records
+def readTrace(filePath: str) -> typing.Tuple[int, array.array]:
+    file = open(filePath, 'rb')
+    data = file.read()
+    file.close()
+
+    if len(data) < TRACE_HEADER.size:
+        raise ValueError("'" + filePath + "' is too short to be a trace file")
+    magic, version, recordSize, first, count = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_FORMAT or recordSize != 8:
+        raise ValueError("'" + filePath + "' is not a version " + str(TRACE_FORMAT) + " trace file")
+
+    records = array.array('Q')
+    records.frombytes(data[TRACE_HEADER.size:TRACE_HEADER.size + 8 * count])
+    if len(records) != count:
+        raise ValueError("'" + filePath + "' is cut off, it should hold " + str(count) + " records")
+    if sys.byteorder != 'little':
+        records.byteswap()
+    return first, records
+
+
+# Function for formatting a record as one line of a trace listing, the control word is shown by the names of its bits
+def formatRecord(record: TraceRecord) -> str:
+    names = [name for name in ("HLT", "MI", "RI", "RO", "II", "IO", "AI", "AO", "BI", "BO", "EO", "SO", "FI", "OI", "OC", "O2", "CE", "CI", "CO", "JC", "JZ", "NXT")
+             if record.word & getattr(emulate.generator, name)]
+    write = record.ramWrite
+    line = (f'{record.cycle:>10d}  PC={record.pc:x} A={record.a:02x} B={record.b:02x} MAR={record.mar:x} CF={int(record.carry)} ZF={int(record.zero)}'
+            f'  bus={record.bus:02x}  {"|".join(names) or "-":24s}' + (f'  RAM[{write[0]:x}]={write[1]:02x}' if write else ''))
+    return line.rstrip()
+
+
+def main():
+    args = argParse()
+
+    # Reading an exported trace back only needs the file itself
+    if args.read:
+        try:
+            first, records = readTrace(args.image)
+        except (OSError, ValueError) as err:
+            printErr("[ERROR] " + str(err))
+            printErr("\tAborting trace....\n")
+            sys.exit(1)
+
+        for offset in range(max(0, len(records) - args.last), len(records)):
+            print(formatRecord(decodeRecord(first + offset, records[offset])))
+        return
+
+    assemble = emulate.loadAssembler()
+    try:
+        machine = emulate.SAP1(emulate.loadRom(args.rom), emulate.loadImage(args.image))
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting trace....\n")
+        sys.exit(1)
+    except assemble.AssemblyError as err:
+        printErr(str(err))
+        printErr("\tAborting trace....\n")
+        sys.exit(1)
+
+    tracer = Tracer(machine, args.capacity)
+    tracer.run(args.max_cycles)
+
+    for cycle in range(max(tracer.first, tracer.end - args.last), tracer.end):
+        print(formatRecord(tracer[cycle]))
+    print(("Halted" if machine.halted else "Stopped") + " after " + str(machine.cycles) + " cycles, cycles " + str(tracer.first) + " to " + str(tracer.end - 1) + " are recorded")
+
+    if args.output is not None:
+        tracer.export(args.output)
+        print("Trace written to " + args.output)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Record every T-state of a program on the headless SAP-1 emulator')
+    parser.add_argument('image', type=str, help="Program to run, either an assembled image or a '.sap' source. With --read, a trace file")
+    parser.add_argument('--rom', type=str, default=emulate.DEFAULT_ROM, help="Microcode ROM to execute. Default -> microcode-rom")
+    parser.add_argument('--max-cycles', type=int, default=10_000_000, help="Stop after this many T-states. Default -> 10000000")
+    parser.add_argument('--capacity', type=int, default=1 << 16, help="T-states the ring buffer holds, older ones are overwritten. Default -> 65536")
+    parser.add_argument('--last', type=int, default=32, help="Number of T-states to list, the most recent ones. Default -> 32")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Export the recorded trace to this binary file")
+    parser.add_argument('--read', action='store_true', help="List the T-states of a trace file written with -o instead of running a program")
+    return parser.parse_args()
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
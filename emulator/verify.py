@@ -0,0 +1,292 @@
+import argparse
+import functools
+import sys
+import typing
+
+import numpy as np
+
+import emulate
+
+
+# Registers the instruction set defines, B, MAR and IR are only there for the microcode to use
+ARCHITECTURAL = ('a', 'pc', 'carry', 'zero', 'out', 'halted', 'ram')
+
+# RAM bytes not involved in an instruction hold this pattern, so a write to the wrong address shows up
+BACKGROUND = (np.arange(16, dtype=np.uint8) * 0x11) ^ 0xa5
+
+
+# Function for building every input an instruction with a given operand field can see, one lane per input
+#   a       -> all 256 values of A
+#   value   -> all 256 values of the RAM byte the operand points at
+#   carry   -> both states of the carry flag
+#   zero    -> both states of the zero flag
+# The instruction sits at the address right after its operand, so over all 16 operands every PC is covered and the two never overlap
+# B and OUT start out different from anything the instruction should leave in them
+# Returns the machine state of every lane, right before the instruction is fetched
+def inputSpace(opcode: int, operand: int) -> typing.Dict[str, np.ndarray]:
+    a, value, carry, zero = laneInputs()
+    lanes = len(a)
+    pc = (operand + 1) & 0x0f
+
+    ram = np.tile(BACKGROUND, (lanes, 1))
+    ram[:, operand] = value
+    ram[:, pc] = (opcode << 4) | operand
+
+    return {
+        "operand": np.full(lanes, operand, dtype=np.uint8),
+        "value": value,
+        "a": a,
+        "b": value ^ 0x5a,
+        "pc": np.full(lanes, pc, dtype=np.uint8),
+        "mar": np.zeros(lanes, dtype=np.uint8),
+        "ir": np.zeros(lanes, dtype=np.uint8),
+        "out": a ^ 0x3c,
+        "carry": carry,
+        "zero": zero,
+        "halted": np.zeros(lanes, dtype=bool),
+        "ram": ram,
+        "outputs": [],
+    }
+
+
+# The A, RAM value and flag inputs are the same for every pass, they are only built once and never written to
+@functools.lru_cache(maxsize=None)
+def laneInputs() -> typing.Tuple[np.ndarray, ...]:
+    a, value, carry, zero = (axis.ravel() for axis in np.indices((256, 256, 2, 2), dtype=np.uint8))
+    return a, value, carry.astype(bool), zero.astype(bool)
+
+
+# Function for running one instruction's control words on every lane at once, the same way the emulator runs them
+# The control word of a step is the same for every lane, only the data differs, so each step is a handful of array operations
+# Returns the machine state of every lane after the instruction
+def executeMicrocode(rom: typing.List[int], opcode: int, state: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+    g = emulate.generator
+    a, b, pc, mar, ir, out = (state[name].astype(np.int16) for name in ('a', 'b', 'pc', 'mar', 'ir', 'out'))
+    carry, zero, halted = state["carry"].copy(), state["zero"].copy(), state["halted"].copy()
+    ram = state["ram"].copy()
+    flat = ram.reshape(-1)
+    rows = np.arange(len(a), dtype=np.int64) * 16
+    outputs = []
+
+    for step in range(len(g.t)):
+        # The fetch cycle is hardwired, everything after it comes from the ROM
+        word = g.FETCH[step] if step < len(g.FETCH) else rom[opcode << 3 | step]
+
+        # Compute the ALU output from the registers as they are during this T-state
+        if word & (g.EO | g.FI):
+            total = a + ((~b & 0xff) + 1 if word & g.SO else b)
+            result = total & 0xff
+
+        # Put the bus drivers onto the bus, conflicting drivers resolve as a wired-OR
+        bus = np.zeros_like(a)
+        if word & g.RO:
+            bus |= flat[rows + mar]
+        if word & g.IO:
+            bus |= ir & 0x0f
+        if word & g.AO:
+            bus |= a
+        if word & g.BO:
+            bus |= b
+        if word & g.EO:
+            bus |= result
+        if word & g.CO:
+            bus |= pc
+
+        # Latch the bus into every register that loads from it
+        if word & g.RI:
+            flat[rows + mar] = bus
+        if word & g.MI:
+            mar = bus & 0x0f
+        if word & g.II:
+            ir = bus
+        if word & g.AI:
+            a = bus
+        if word & g.BI:
+            b = bus
+        if word & g.OI:
+            out = bus
+            outputs.append(bus)
+        if word & g.OC:
+            out = np.zeros_like(out)
+
+        # Program counter, a load takes priority over counting
+        if word & g.CE:
+            pc = (pc + 1) & 0x0f
+        if word & g.CI:
+            pc = bus & 0x0f
+        if word & g.JC:
+            pc = np.where(carry, ir & 0x0f, pc)
+        if word & g.JZ:
+            pc = np.where(zero, ir & 0x0f, pc)
+
+        # Flags are latched after the conditional jumps have looked at them
+        if word & g.FI:
+            carry = total > 0xff
+            zero = result == 0
+
+        if word & g.HLT:
+            halted = np.ones_like(halted)
+            break
+        if word & g.NXT:
+            break
+
+    return {"a": a, "b": b, "pc": pc, "mar": mar, "ir": ir, "out": out, "carry": carry, "zero": zero, "halted": halted, "ram": ram, "outputs": outputs}
+
+
+# Reference model of the instruction set, what every instruction does to the registers the ISA defines
+# It is written from the instruction set alone and knows nothing about control words or micro-steps
+# Returns the machine state every lane should end up in
+def referenceModel(mnemonic: str, state: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+    expected = {name: state[name].copy() for name in ARCHITECTURAL}
+    expected["outputs"] = []
+    operand, value = state["operand"].astype(np.int16), state["value"].astype(np.int16)
+    a = state["a"].astype(np.int16)
+
+    # Every instruction moves the PC past itself unless it jumps
+    expected["pc"] = (state["pc"].astype(np.int16) + 1) & 0x0f
+
+    match mnemonic:
+        case "LDA":
+            expected["a"] = value
+        case "ADD":
+            expected["a"] = (a + value) & 0xff
+            expected["carry"] = a + value > 0xff
+            expected["zero"] = expected["a"] == 0
+        case "SUB":
+            # Carry is set when nothing had to be borrowed
+            expected["a"] = (a - value) & 0xff
+            expected["carry"] = a >= value
+            expected["zero"] = expected["a"] == 0
+        case "STA":
+            expected["ram"][np.arange(len(a)), operand] = a
+        case "LDI":
+            expected["a"] = operand
+        case "JMP":
+            expected["pc"] = operand
+        case "JC":
+            expected["pc"] = np.where(state["carry"], operand, expected["pc"])
+        case "JZ":
+            expected["pc"] = np.where(state["zero"], operand, expected["pc"])
+        case "CLR":
+            expected["out"] = np.zeros_like(a)
+        case "OUT":
+            expected["out"] = a
+            expected["outputs"] = [a]
+        case "HLT":
+            expected["halted"] = np.ones_like(state["halted"])
+
+    # NOP and the reserved instructions leave everything else alone
+    return expected
+
+
+# Function for finding every lane where the microcode and the reference model disagree
+# Returns a mask of the failing lanes along with a mask per register that was wrong
+def compareStates(got: dict, expected: dict) -> typing.Tuple[np.ndarray, typing.Dict[str, np.ndarray]]:
+    wrong = {}
+    for name in ARCHITECTURAL:
+        wrong[name] = got[name] != expected[name]
+
+    # RAM is compared as two 64 bit words per lane, much quicker than 16 bytes
+    mismatch = got["ram"].view(np.uint64) != expected["ram"].view(np.uint64)
+    wrong["ram"] = mismatch[:, 0] | mismatch[:, 1]
+
+    # A missing or extra OUT fails every lane, otherwise the values are compared
+    if len(got["outputs"]) != len(expected["outputs"]):
+        wrong["outputs"] = np.ones(len(got["a"]), dtype=bool)
+    else:
+        wrong["outputs"] = np.zeros(len(got["a"]), dtype=bool)
+        for value, expectedValue in zip(got["outputs"], expected["outputs"]):
+            wrong["outputs"] |= value != expectedValue
+
+    failing = np.zeros(len(got["a"]), dtype=bool)
+    for mismatch in wrong.values():
+        failing |= mismatch
+    return failing, wrong
+
+
+# Function for checking every opcode of a microcode ROM against the reference model over its whole input space
+# Each opcode runs as one vectorized pass per operand field, 262144 lanes at a time keeps memory use low
+# Returns a report per mnemonic: the number of inputs, the number that failed and up to `examples` counterexamples
+def verifyRom(rom: typing.List[int], examples: int = 3) -> typing.Dict[str, dict]:
+    report = {}
+    for mnemonic, opcode in emulate.generator.instructions.items():
+        result = {"inputs": 0, "failures": 0, "counterexamples": []}
+        for operand in range(16):
+            state = inputSpace(opcode, operand)
+            got = executeMicrocode(rom, opcode, state)
+            expected = referenceModel(mnemonic, state)
+            failing, wrong = compareStates(got, expected)
+
+            result["inputs"] += len(failing)
+            result["failures"] += int(failing.sum())
+            for lane in np.flatnonzero(failing)[:examples - len(result["counterexamples"])]:
+                result["counterexamples"].append(formatCounterexample(lane, state, got, expected, wrong))
+        report[mnemonic] = result
+    return report
+
+
+# Function for describing a single failing input, what went in and each register that came out wrong
+def formatCounterexample(lane: int, state: dict, got: dict, expected: dict, wrong: dict) -> str:
+    inputs = (f'A={int(state["a"][lane]):02x} M[{int(state["operand"][lane]):x}]={int(state["value"][lane]):02x} '
+              f'CF={int(state["carry"][lane])} ZF={int(state["zero"][lane])} PC={int(state["pc"][lane]):x}')
+
+    results = []
+    for name, mismatch in wrong.items():
+        if not mismatch[lane]:
+            continue
+        if name == "outputs":
+            results.append("outputs " + str([int(value[lane]) for value in got["outputs"]]) + " expected " + str([int(value[lane]) for value in expected["outputs"]]))
+        elif name == "ram":
+            addresses = np.flatnonzero(got["ram"][lane] != expected["ram"][lane])
+            results += [f'M[{address:x}]={int(got["ram"][lane][address]):02x} expected {int(expected["ram"][lane][address]):02x}' for address in addresses]
+        else:
+            results.append(f'{name}={int(got[name][lane]):x} expected {int(expected[name][lane]):x}')
+
+    return inputs + " -> " + ', '.join(results)
+
+
+# Function for printing a verification report
+# Returns True if every opcode passed
+def printReport(report: typing.Dict[str, dict], file: typing.TextIO = sys.stdout) -> bool:
+    for mnemonic, result in report.items():
+        if result["failures"] == 0:
+            print(f'{mnemonic:5s} ok, {result["inputs"]} inputs', file=file)
+            continue
+
+        print(f'{mnemonic:5s} FAILED on {result["failures"]} of {result["inputs"]} inputs, e.g.', file=file)
+        for counterexample in result["counterexamples"]:
+            print("      " + counterexample, file=file)
+
+    return all(result["failures"] == 0 for result in report.values())
+
+
+def main():
+    args = argParse()
+
+    try:
+        rom = emulate.loadRom(args.rom)
+    except (OSError, ValueError) as err:
+        printErr("[ERROR] " + str(err))
+        printErr("\tAborting verification....\n")
+        sys.exit(1)
+
+    if not printReport(verifyRom(rom, args.examples)):
+        printErr("[ERROR] The microcode ROM does not implement the instruction set")
+        sys.exit(1)
+
+
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Check every opcode of a microcode ROM against a reference model of the SAP-1 instruction set')
+    parser.add_argument('--rom', type=str, default=emulate.DEFAULT_ROM, help="Microcode ROM to verify. Default -> microcode-rom")
+    parser.add_argument('--examples', type=int, default=3, help="Counterexamples to show for each failing opcode. Default -> 3")
+    return parser.parse_args()
+
+
+# Easy error printing
+def printErr(msg: str):
+    print(msg, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import dataclasses
+import functools
+import json
+import os
+
+
+# The data bus, RAM words and instruction bytes are all this wide
+WORD_BITS = 8
+
+# Every single byte value, so encoding a one byte instruction is a lookup rather than building new bytes
+BYTE_VALUES = tuple(bytes([value]) for value in range(1 << WORD_BITS))
+
+# The SAP-1 instruction set has 16 opcodes, an opcode has to be wide enough to tell them apart
+MIN_OPCODE_BITS = 4
+
+# The fetch cycle alone takes two micro-steps
+MIN_STEP_BITS = 2
+
+
+# Describe the layout of a SAP-1 variant, both the assembler and the micro-code generator are built around it
+#   addressBits -> width of a RAM address, RAM holds 2**addressBits bytes
+#   opcodeBits  -> width of an opcode, the top bits of an instruction's first byte
+#   stepBits    -> width of the micro-step counter, every opcode gets 2**stepBits micro-code words
+#
+# When an opcode and an address fit in one byte, every instruction is a single byte with its operand in the low bits (the original SAP-1)
+# Otherwise an operand gets the byte right after the opcode, so instructions that take one are two bytes long
+#
+# The assembler asks for the derived values below on every instruction, so each is worked out once per machine and then kept
+@dataclasses.dataclass(frozen=True)
+class Machine:
+    """Class describing the RAM size and instruction layout of a SAP-1 variant"""
+    name: str
+    addressBits: int = 4
+    opcodeBits: int = 4
+    stepBits: int = 3
+
+    def __post_init__(self):
+        # MAR is loaded straight off the bus, so an address can't be wider than a word
+        if not 1 <= self.addressBits <= WORD_BITS:
+            raise ValueError("Machine '" + self.name + "' has " + str(self.addressBits) + " address bits, it must have 1 to " + str(WORD_BITS))
+        if not MIN_OPCODE_BITS <= self.opcodeBits <= WORD_BITS:
+            raise ValueError("Machine '" + self.name + "' has " + str(self.opcodeBits) + " opcode bits, it must have " + str(MIN_OPCODE_BITS) + " to " + str(WORD_BITS))
+        if not MIN_STEP_BITS <= self.stepBits <= WORD_BITS:
+            raise ValueError("Machine '" + self.name + "' has " + str(self.stepBits) + " step bits, it must have " + str(MIN_STEP_BITS) + " to " + str(WORD_BITS))
+
+    # Bytes of RAM
+    @functools.cached_property
+    def ramSize(self) -> int:
+        return 1 << self.addressBits
+
+    # Every RAM address
+    @functools.cached_property
+    def addressRange(self) -> range:
+        return range(0, self.ramSize)
+
+    # True when operands take a byte of their own
+    @functools.cached_property
+    def multiByte(self) -> bool:
+        return self.opcodeBits + self.addressBits > WORD_BITS
+
+    # Width of an operand, the low bits of the instruction byte or the whole byte after it
+    @functools.cached_property
+    def operandBits(self) -> int:
+        return WORD_BITS if self.multiByte else WORD_BITS - self.opcodeBits
+
+    # Micro-code words per opcode
+    @functools.cached_property
+    def steps(self) -> int:
+        return 1 << self.stepBits
+
+    # Words in the micro-code ROM
+    @functools.cached_property
+    def romSize(self) -> int:
+        return 1 << (self.opcodeBits + self.stepBits)
+
+    # Bytes of RAM an operand adds to an instruction
+    @functools.cached_property
+    def operandSize(self) -> int:
+        return 1 if self.multiByte else 0
+
+    # Shift that puts an opcode into the top bits of an instruction byte
+    @functools.cached_property
+    def opcodeShift(self) -> int:
+        return WORD_BITS - self.opcodeBits
+
+    # Bytes of RAM an instruction takes up
+    def instructionSize(self, hasOperand: bool) -> int:
+        return 1 + self.operandSize if hasOperand else 1
+
+    # Encode an instruction as the bytes that go into RAM
+    def encode(self, opcode: int, operand: int = None) -> bytes:
+        if operand is None:
+            return BYTE_VALUES[opcode << self.opcodeShift]
+        if self.multiByte:
+            return bytes((opcode << self.opcodeShift, operand))
+        return BYTE_VALUES[(opcode << self.opcodeShift) | operand]
+
+
+# Define the built in machines
+#   sap1     -> Ben's 16 byte SAP-1, what SAP1.circ implements
+#   sap1-256 -> the same instruction set with 256 bytes of RAM and two byte instructions
+machines = {
+    "sap1": Machine("sap1"),
+    "sap1-256": Machine("sap1-256", addressBits=8),
+}
+DEFAULT_MACHINE = machines["sap1"]
+
+
+# Load a machine by the name of a built in one, or from a JSON file of Machine fields
+#   Ex) {"addressBits": 6, "opcodeBits": 5, "stepBits": 3}
+def Load_Machine(description: str) -> Machine:
+    if description in machines:
+        return machines[description]
+    if not os.path.exists(description):
+        raise ValueError("Machine '" + description + "' is not one of " + ', '.join(machines) + " or a machine description file")
+
+    file = open(description, 'r')
+    try:
+        fields = json.load(file)
+    except json.JSONDecodeError as err:
+        raise ValueError("Machine description '" + description + "' is not valid JSON: " + str(err))
+    finally:
+        file.close()
+
+    if not isinstance(fields, dict):
+        raise ValueError("Machine description '" + description + "' has to be a JSON object")
+    fields.setdefault("name", os.path.splitext(os.path.basename(description))[0])
+    try:
+        return Machine(**fields)
+    except TypeError:
+        known = [field.name for field in dataclasses.fields(Machine)]
+        raise ValueError("Machine description '" + description + "' can only have the fields " + ', '.join(known))
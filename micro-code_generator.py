@@ -1,4 +1,12 @@
-import typing
+import argparse
+import array
+import hashlib
+import os
+import sys
+
+# The machine description is shared with the assembler
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from machine_description import DEFAULT_MACHINE, Load_Machine, Machine
 
 
 # Define Micro-code bits
@@ -63,6 +71,76 @@ t = [t0, t1, t2, t3, t4, t5, t6, t7]
 FETCH = [CO|MI, RO|II|CE]
 
 
+# Define the micro-steps each instruction runs after the fetch cycle
+# Instructions are padded out with NXT, so every instruction ends at its first NXT
+# Reserved instructions are treated as NOP
+microcode = {
+    "NOP":   [NXT],
+    "LDA":   [IO|MI, RO|AI],
+    "ADD":   [IO|MI, RO|BI, EO|AI|FI],
+    "SUB":   [IO|MI, RO|BI, SO|EO|AI|FI],
+    "STA":   [IO|MI, AO|RI],
+    "LDI":   [IO|AI],
+    "JMP":   [IO|CI],
+    "JC":    [JC],
+    "JZ":    [JZ],
+
+    "RES6":  [NXT],
+    "RES7":  [NXT],
+    "RES8":  [NXT],
+    "RES9":  [NXT],
+
+    "CLR":   [OC],
+    "OUT":   [AO|OI],
+    "HLT":   [HLT],
+}
+
+# Define which control bits drive the bus and which load what is on it into a register
+# Only one driver may be active in a step, a load in a step with no driver reads a floating bus
+bus_drivers = {RO: "RO", IO: "IO", AO: "AO", BO: "BO", EO: "EO", CO: "CO"}
+bus_loaders = {MI: "MI", RI: "RI", II: "II", AI: "AI", BI: "BI", OI: "OI", CI: "CI"}
+
+# Define the state each control bit reads and writes, used to tell when two micro-ops can share a step
+# Everything read in a step is read before the clock edge and everything written is written on it
+reads = {
+    RO: {"MAR", "RAM"},
+    IO: {"IR"},
+    AO: {"A"},
+    BO: {"B"},
+    EO: {"A", "B"},
+    SO: {"A", "B"},
+    FI: {"A", "B"},
+    RI: {"MAR"},
+    CO: {"PC"},
+    CE: {"PC"},
+    JC: {"IR", "CF"},
+    JZ: {"IR", "ZF"},
+}
+writes = {
+    MI: {"MAR"},
+    RI: {"RAM"},
+    II: {"IR"},
+    AI: {"A"},
+    BI: {"B"},
+    FI: {"CF", "ZF"},
+    OI: {"OUT"},
+    OC: {"OUT"},
+    O2: {"OCU"},
+    CE: {"PC"},
+    CI: {"PC"},
+    JC: {"PC"},
+    JZ: {"PC"},
+}
+
+# Output files, a machine other than the default gets its name added to each of them
+ROM_TEXT = "./microcode-rom"
+ROM_BINARY = "./microcode-rom.bin"
+ROM_MODULE = "./microcode_rom.py"
+
+# Bump when the layout of any output file changes so they get rewritten
+FORMAT_VERSION = 1
+
+
 # Generate the micro-code ROM
 # 
 # Micro-code ROM Addressing scheme:
@@ -70,217 +148,268 @@ FETCH = [CO|MI, RO|II|CE]
 #   where:
 #       i -> is the binary representation of the instruction
 #       t -> is the current micro-code step
+# The number of i and t bits comes from the machine description (--machine), the default is the layout above
 # 
 def main():
-    file = open("./microcode-rom", 'w')
-    file.write("v3.0 hex words plain\n")
-
-    for mnemonic in instructions:
-
-        # Binary representation of the mnemonic
-        instruction = instructions[mnemonic]
-
-        # Treat reserved instructions as NOP
-        if "RES" in mnemonic:
-            Write_NOP(instruction, file)
-            continue
-
-        match mnemonic:
-
-            case "NOP":
-                Write_NOP(instruction, file)
-
-            case "LDA":
-                Write_LDA(instruction, file)
-
-            case "ADD":
-                Write_ADD(instruction, file)
+    args = argParse()
+    machine = args.machine
+    romText, romBinary, romModule = Output_Files(machine)
 
-            case "SUB":
-                Write_SUB(instruction, file)
+    Verify_Microcode(machine)
 
-            case "STA":
-                Write_STA(instruction, file)
-            
-            case "LDI":
-                Write_LDI(instruction, file)
+    rom = Gen_Rom(args.compact, machine)
+    if not args.skip_semantics:
+        Verify_Semantics(rom, machine)
+    romHash = Hash_Rom(rom)
+    if args.compact:
+        Print_Compaction(Gen_Rom(machine=machine), rom, machine)
 
-            case "JMP":
-                Write_JMP(instruction, file)
+    # Nothing to do if the ROM is the same as the one already on disk
+    if not args.force and Read_Hash(romModule) == romHash and os.path.exists(romText) and os.path.exists(romBinary):
+        print("Micro-code ROM unchanged, nothing written")
+        return
 
-            case "JC":
-                Write_JC(instruction, file)
-            
-            case "JZ":
-                Write_JZ(instruction, file)
-            
+    Write_Text(rom, romText, machine)
+    Write_Binary(rom, romBinary)
+    Write_Module(rom, romHash, romModule, machine)
+    print("Micro-code ROM written for " + machine.name)
 
-            case "RES6":
-                Write_RES6(instruction, file)
-            
-            case "RES7":
-                Write_RES7(instruction, file)
-            
-            case "RES8":
-                Write_RES8(instruction, file)
 
-            case "RES9":
-                Write_RES9(instruction, file)
+# Get the text, binary and module file names for a machine's ROM
+def Output_Files(machine: Machine) -> tuple:
+    if machine == DEFAULT_MACHINE:
+        return ROM_TEXT, ROM_BINARY, ROM_MODULE
 
-            
-            case "CLR":
-                Write_CLR(instruction, file)
-            
-            case "OUT":
-                Write_OUT(instruction, file)
+    suffix = "-" + machine.name
+    return ROM_TEXT + suffix, ROM_TEXT + suffix + ".bin", ROM_MODULE[:-len(".py")] + suffix.replace("-", "_") + ".py"
 
-            case "HLT":
-                Write_HLT(instruction, file)
 
-            case _:
-                print("Warning: No case for instruction -> " + mnemonic)
-                Write_NOP(instruction, file)
+# Build the whole ROM in one pass from the micro-code table
+# Compacting merges micro-ops that can share a step and ends every instruction on its last step
+# Opcodes the instruction set doesn't use (on machines with wider opcodes) are left as NOP
+def Gen_Rom(compact: bool = False, machine: Machine = DEFAULT_MACHINE) -> array.array:
+    rom = array.array('I', [NXT]) * machine.romSize
 
-    file.close()
-
-
-# Generate NOP Micro-code for an instruction
-def Write_NOP(instruction: int, file: typing.TextIO):
-    file.writelines(Gen_Microcode(instruction, NXT))
-    
-# Generate LDA Micro-code for an instruction
-def Write_LDA(instruction: int, file: typing.TextIO):
-    i2 = IO|MI
-    i3 = RO|AI
-
-    file.writelines(Gen_Microcode(instruction, i2, i3))
-
-# Generate ADD Micro-code for an instruction
-def Write_ADD(instruction: int, file: typing.TextIO):
-    i2 = IO|MI
-    i3 = RO|BI
-    i4 = EO|AI|FI
+    for mnemonic, instruction in instructions.items():
+        steps = Machine_Steps(mnemonic, machine)
+        steps = FETCH + (Compact_Steps(steps) if compact else steps)
+        if len(steps) > machine.steps:
+            print("ERROR: Instruction " + mnemonic + " has more than " + str(machine.steps) + " micro-steps", file=sys.stderr)
+            sys.exit(1)
 
-    file.writelines(Gen_Microcode(instruction, i2, i3, i4))
+        start = instruction << machine.stepBits
+        rom[start:start + len(steps)] = array.array('I', steps)
 
-# Generate SUB Micro-code for an instruction
-def Write_SUB(instruction: int, file: typing.TextIO):
-    i2 = IO|MI
-    i3 = RO|BI
-    i4 = SO|EO|AI|FI
+    return rom
 
-    file.writelines(Gen_Microcode(instruction, i2, i3, i4))
 
-# Generate STA Micro-code for an instruction
-def Write_STA(instruction: int, file: typing.TextIO):
-    i2 = IO|MI
-    i3 = AO|RI
-
-    file.writelines(Gen_Microcode(instruction, i2, i3))
-
-# Generate LDI Micro-code for an instruction
-def Write_LDI(instruction: int, file: typing.TextIO):
-    i2 = IO|AI
-
-    file.writelines(Gen_Microcode(instruction, i2))
+# Get the most micro-steps any instruction takes on a machine, the fetch included
+def Longest_Instruction(compact: bool = False, machine: Machine = DEFAULT_MACHINE) -> int:
+    longest = 0
+    for mnemonic in instructions:
+        steps = Machine_Steps(mnemonic, machine)
+        longest = max(longest, len(FETCH) + len(Compact_Steps(steps) if compact else steps))
+    return longest
+
+
+# Run every opcode of the ROM over its whole input space and compare it with a reference model of the instruction set
+# The verifier lives with the emulator and needs NumPy, without it the check is skipped
+def Verify_Semantics(rom: array.array, machine: Machine = DEFAULT_MACHINE):
+    if machine != DEFAULT_MACHINE:
+        print("Semantic check skipped, the reference model is the 16 byte SAP-1")
+        return
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator"))
+    try:
+        import verify
+    except ImportError:
+        print("Semantic check skipped, it needs NumPy")
+        return
+
+    report = verify.verifyRom(list(rom))
+    if not all(result["failures"] == 0 for result in report.values()):
+        verify.printReport(report, sys.stderr)
+        print("ERROR: The micro-code doesn't implement the instruction set, nothing written", file=sys.stderr)
+        sys.exit(1)
+    print("Semantic check passed, every opcode matches the instruction set on all " + str(sum(result["inputs"] for result in report.values())) + " inputs")
+
+
+# Get an instruction's micro-steps on a machine
+# On a machine with two byte instructions the operand isn't in the instruction register, it is the byte the PC points at after the fetch
+# Every step that takes the operand from the instruction register (IO, or a JC/JZ jump) is split in two:
+#   CO|MI          -> address the operand byte
+#   RO|...|CE      -> read it in place of IO and move the PC past it, a JMP loads the PC anyway so it doesn't count
+# JC and JZ load the PC from the bus instead of the instruction register, the counter's load wins over CE when the jump is taken
+def Machine_Steps(mnemonic: str, machine: Machine = DEFAULT_MACHINE) -> list:
+    steps = microcode.get(mnemonic, [NXT])
+    if not machine.multiByte:
+        return steps
+
+    converted = []
+    for word in steps:
+        if not word & (IO | JC | JZ):
+            converted.append(word)
+            continue
 
-# Generate JMP Micro-code for an instruction
-def Write_JMP(instruction: int, file: typing.TextIO):
-    i2 = IO|CI
+        word = (word & ~IO) | RO
+        converted += [CO|MI, word if word & CI else word | CE]
+    return converted
+
+
+# Check every step of every instruction, the fetch included, against the bus model
+# Two drivers in a step short the bus, and loading the bus with nothing driving it reads garbage
+def Verify_Microcode(machine: Machine = DEFAULT_MACHINE):
+    # Steps are numbered by T-state, the way they sit in the opcode's rows of the ROM, so an instruction's first step comes right after the fetch
+    for mnemonic, steps, first in [("FETCH", FETCH, 0)] + [(mnemonic, Machine_Steps(mnemonic, machine), len(FETCH)) for mnemonic in microcode]:
+        for step, word in enumerate(steps, first):
+            drivers = [name for bit, name in bus_drivers.items() if word & bit]
+            loaders = [name for bit, name in bus_loaders.items() if word & bit]
+
+            if len(drivers) > 1:
+                print("ERROR: " + mnemonic + " step " + str(step) + " has more than one bus driver: " + ', '.join(drivers), file=sys.stderr)
+                sys.exit(1)
+            if loaders and not drivers:
+                print("ERROR: " + mnemonic + " step " + str(step) + " loads the bus with nothing driving it: " + ', '.join(loaders), file=sys.stderr)
+                sys.exit(1)
+
+
+# Get everything a control word reads or writes
+def Word_State(word: int, table: dict) -> set:
+    return set().union(*(state for bit, state in table.items() if word & bit))
+
+
+# Check if two adjacent steps can run as one without changing what they do
+#   - at most one of them may drive the bus, and a step with a driver can't share with loads meant for the other step's value
+#   - the second step can't read anything the first one writes, it would still see the old value
+#   - they can't both write the same thing
+#   - halting and ending the instruction stay where they are
+def Can_Merge(first: int, second: int) -> bool:
+    if (first | second) & (HLT | NXT):
+        return False
+
+    drivesFirst, drivesSecond = any(first & bit for bit in bus_drivers), any(second & bit for bit in bus_drivers)
+    loadsFirst, loadsSecond = any(first & bit for bit in bus_loaders), any(second & bit for bit in bus_loaders)
+    if (drivesFirst and drivesSecond) or (drivesFirst and loadsSecond) or (drivesSecond and loadsFirst):
+        return False
+
+    if Word_State(second, reads) & Word_State(first, writes):
+        return False
+
+    return not Word_State(first, writes) & Word_State(second, writes)
+
+
+# Compact an instruction's micro-steps
+# Adjacent steps are merged wherever Can_Merge allows, then NXT goes on the last step instead of taking a step of its own
+def Compact_Steps(steps: list) -> list:
+    compacted = []
+    for word in steps:
+        if word == NXT:
+            break
+        if compacted and Can_Merge(compacted[-1], word):
+            compacted[-1] |= word
+        else:
+            compacted.append(word)
 
-    file.writelines(Gen_Microcode(instruction, i2))
+    # An instruction that halts never gets to the next one, and one with no steps still needs its NXT
+    if not compacted:
+        return [NXT]
+    if not compacted[-1] & HLT:
+        compacted[-1] |= NXT
+    return compacted
 
-# Generate JC Micro-code for an instruction
-def Write_JC(instruction: int, file: typing.TextIO):
-    i2 = JC
 
-    file.writelines(Gen_Microcode(instruction, i2))
+# Count the T-states each instruction takes, the fetch steps plus every step up to the first NXT (or HLT)
+def Count_Cycles(rom: array.array, machine: Machine = DEFAULT_MACHINE) -> dict:
+    cycles = {}
+    for mnemonic, instruction in instructions.items():
+        steps = rom[instruction << machine.stepBits:(instruction + 1) << machine.stepBits]
+        cycles[mnemonic] = next((step + 1 for step in range(len(FETCH), machine.steps) if steps[step] & (NXT | HLT)), machine.steps)
+    return cycles
 
-# Generate JZ Micro-code for an instruction
-def Write_JZ(instruction: int, file: typing.TextIO):
-    i2 = JZ
 
-    file.writelines(Gen_Microcode(instruction, i2))
+# Print the T-states each instruction saves in the compacted ROM
+def Print_Compaction(rom: array.array, compacted: array.array, machine: Machine = DEFAULT_MACHINE):
+    before, after = Count_Cycles(rom, machine), Count_Cycles(compacted, machine)
+    for mnemonic in instructions:
+        if before[mnemonic] != after[mnemonic]:
+            print(f'{mnemonic:5s} {before[mnemonic]} -> {after[mnemonic]} T-states, saved {before[mnemonic] - after[mnemonic]}')
+    print("Compacted away " + str(sum(before.values()) - sum(after.values())) + " T-states across all instructions")
 
 
-# Generate RES6 Micro-code for an instruction
-def Write_RES6(instruction: int, file: typing.TextIO):
-    i2 = NXT
+# Hash everything that ends up in the output files
+def Hash_Rom(rom: array.array) -> str:
+    return hashlib.sha256(str(FORMAT_VERSION).encode() + Pack_Rom(rom)).hexdigest()
 
-    file.writelines(Gen_Microcode(instruction, i2))
 
-# Generate RES7 Micro-code for an instruction
-def Write_RES7(instruction: int, file: typing.TextIO):
-    i2 = NXT
-    
-    file.writelines(Gen_Microcode(instruction, i2))
+# Pack the ROM as raw little-endian 32-bit words
+def Pack_Rom(rom: array.array) -> bytes:
+    packed = array.array('I', rom)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
 
-# Generate RES8 Micro-code for an instruction
-def Write_RES8(instruction: int, file: typing.TextIO):
-    i2 = NXT
-    
-    file.writelines(Gen_Microcode(instruction, i2))
 
-# Generate RES9 Micro-code for an instruction
-def Write_RES9(instruction: int, file: typing.TextIO):
-    i2 = NXT
-    
-    file.writelines(Gen_Microcode(instruction, i2))
+# Read the hash of the ROM that was last written, empty if there is none
+def Read_Hash(filePath: str = ROM_MODULE) -> str:
+    if not os.path.exists(filePath):
+        return ""
 
+    file = open(filePath, 'r')
+    header = file.readline()
+    file.close()
+    return header.strip().split("sha256: ")[-1]
 
-# Generate CLR Micro-code for an instruction
-def Write_CLR(instruction: int, file: typing.TextIO):
-    i2 = OC
 
-    file.writelines(Gen_Microcode(instruction, i2))
+# Write the ROM as a Logisim 'v3.0 hex words plain' file, one instruction per line
+def Write_Text(rom: array.array, filePath: str = ROM_TEXT, machine: Machine = DEFAULT_MACHINE):
+    lines = ["v3.0 hex words plain\n"]
+    for address in range(0, len(rom), machine.steps):
+        lines.append(' '.join(f'{word:06x}' for word in rom[address:address + machine.steps]) + "\n")
 
-# Generate OUT Micro-code for an instruction
-def Write_OUT(instruction: int, file: typing.TextIO):
-    i2 = AO|OI
+    file = open(filePath, 'w')
+    file.writelines(lines)
+    file.close()
 
-    file.writelines(Gen_Microcode(instruction, i2))
 
-# Generate HLT Micro-code for an instruction
-def Write_HLT(instruction: int, file: typing.TextIO):
-    i2 = HLT
+# Write the ROM as raw little-endian 32-bit words
+def Write_Binary(rom: array.array, filePath: str = ROM_BINARY):
+    file = open(filePath, 'wb')
+    file.write(Pack_Rom(rom))
+    file.close()
 
-    file.writelines(Gen_Microcode(instruction, i2))
-    
 
-# Generate Microcode for each specified step for a given instruction
-# This function returns the lines needed for writing to the Micro-Code ROM
-def Gen_Microcode(instruction: int, i2: int, i3: int = int('00001', 16), i4: int = int('00001', 16), i5: int = int('00001', 16), i6: int = int('00001', 16), i7: int = int('00001', 16)) -> typing.List[str]:
-    lines: typing.List[str] = []
-    
-    for step in t:
-        romAddress = "{0:02x}: ".format(int(str(f'{instruction:x}' + f'{t[step]:x}'), 16))
-        romAddress = ""
+# Write the ROM as a python module so tools can import it without parsing anything
+def Write_Module(rom: array.array, romHash: str, filePath: str = ROM_MODULE, machine: Machine = DEFAULT_MACHINE):
+    file = open(filePath, 'w')
+    file.write("# Generated by micro-code_generator.py, do not edit. sha256: " + romHash + "\n")
+    file.write("ROM_HASH = '" + romHash + "'\n")
+    file.write("ROM = (\n")
+    for address in range(0, len(rom), machine.steps):
+        file.write("    " + ' '.join(f'0x{word:06x},' for word in rom[address:address + machine.steps]) + "\n")
+    file.write(")\n")
+    file.close()
 
-        # Define Fetch Cycle
-        if(step == t0 or step == t1):
-            microcode = "{0:06x} ".format(FETCH[step])
-            lines.append(romAddress + microcode)
-            continue
 
-        if step == t2:
-            microcode = "{0:06x} ".format(i2)
-        elif step == t3:
-            microcode = "{0:06x} ".format(i3)
-        elif step == t4:
-            microcode = "{0:06x} ".format(i4)
-        elif step == t5:
-            microcode = "{0:06x} ".format(i5)
-        elif step == t6:
-            microcode = "{0:06x} ".format(i6)
-        elif step == t7:
-            microcode = "{0:06x}\n".format(i7)
-        else:
-            print("ERROR: Unknown time step -> " + str(step))
-            exit()
-            
-        lines.append(romAddress + microcode)
-    
-    return lines
+# Argument Parsing
+def argParse() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='The SAP-1 micro-code ROM generator!')
+    parser.add_argument('-f', '--force', action='store_true', help="Write the ROM files even if the micro-code hasn't changed")
+    parser.add_argument('-c', '--compact', action='store_true', help="Merge micro-ops that can share a step and end each instruction on its last step instead of a step of its own")
+    parser.add_argument('--skip-semantics', action='store_true', help="Don't check the ROM against the reference model of the instruction set")
+    parser.add_argument('-m', '--machine', type=str, default=DEFAULT_MACHINE.name, help="Machine to generate the ROM for, sap1, sap1-256 or a machine description JSON file. Default -> sap1")
+    args = parser.parse_args()
+
+    try:
+        args.machine = Load_Machine(args.machine)
+    except ValueError as err:
+        parser.error(str(err))
+
+    # Every opcode's row of the ROM has to hold the fetch and the instruction's own steps
+    longest = Longest_Instruction(args.compact, args.machine)
+    if longest > args.machine.steps:
+        parser.error("machine '" + args.machine.name + "' has " + str(args.machine.stepBits) + " step bits, room for " + str(args.machine.steps) +
+                     " micro-steps, but the longest instruction takes " + str(longest) + " with the fetch")
+    return args
 
 
 if __name__ == "__main__":
@@ -0,0 +1,20 @@
+# Generated by micro-code_generator.py, do not edit. sha256: cad6bd4b6d8fddeb5a663be21a50d82a1a56ca8ff805fd7b5e85ac7f82bffd92
+ROM_HASH = 'cad6bd4b6d8fddeb5a663be21a50d82a1a56ca8ff805fd7b5e85ac7f82bffd92'
+ROM = (
+    0x400020, 0x180080, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x440000, 0x120000, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x440000, 0x108000, 0x022800, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x440000, 0x108000, 0x023800, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x440000, 0x210000, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x060000, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x040040, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000010, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000008, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x000200, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x010400, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+    0x400020, 0x180080, 0x800000, 0x000001, 0x000001, 0x000001, 0x000001, 0x000001,
+)
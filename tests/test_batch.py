@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assembler"))
+import assemble
+
+
+# Function for assembling every '.sap' file in a directory, keyed by file name
+def assembleDirectory(directory) -> dict:
+    results = assemble.assembleBatch(assemble.expandInputs([str(directory)]), 1)
+    return {os.path.basename(result.inputFile): result for result in results}
+
+
+def test_source_that_is_not_utf8_fails_alone(tmp_path):
+    (tmp_path / "bad.sap").write_bytes(b"ldi \xb2\nout\nhlt\n")
+    (tmp_path / "good.sap").write_text("ldi 3\nout\nhlt\n")
+
+    results = assembleDirectory(tmp_path)
+    assert not results["bad.sap"].succeeded
+    assert "utf-8" in results["bad.sap"].error
+    assert results["good.sap"].succeeded
+
+
+def test_non_ascii_digit_fails_alone(tmp_path):
+    (tmp_path / "bad.sap").write_text("ldi ²\nout\nhlt\n", encoding="utf-8")
+    (tmp_path / "good.sap").write_text("ldi 3\nout\nhlt\n")
+
+    results = assembleDirectory(tmp_path)
+    assert not results["bad.sap"].succeeded
+    assert "not a valid integer" in results["bad.sap"].error
+    assert results["good.sap"].succeeded
@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emulator"))
+import emulate
+
+assemble = emulate.loadAssembler()
+
+
+# Threading 'jmp a' past 'a: jmp b' leaves that 'jmp' with nothing reaching it, so threading it as well saves no cycles
+THREADED_PAST = """\
+set 0xf,1
+ldi 3
+nop
+sta 0xe
+lda 0xe
+jmp a
+a:
+jmp b
+c:
+out
+sub 0xf
+jz done
+jmp c
+b:
+jmp c
+done:
+hlt
+"""
+
+
+# Function for running an assembled image to 'hlt' on the microcode emulator
+def runImage(image: bytes) -> emulate.SAP1:
+    machine = emulate.SAP1(emulate.loadRom(), image)
+    assert machine.run(10_000)
+    return machine
+
+
+def test_cycles_saved_match_the_emulator():
+    tokens = assemble.labelLink(assemble.stripFile(THREADED_PAST))
+    before = runImage(assemble.assemble(tokens))
+
+    tokens = assemble.labelLink(assemble.stripFile(THREADED_PAST))
+    optimized, changes = assemble.optimize(tokens)
+    after = runImage(assemble.assemble(optimized))
+
+    assert after.outputs == before.outputs
+    assert sum(change.cyclesSaved for change in changes) == before.cycles - after.cycles